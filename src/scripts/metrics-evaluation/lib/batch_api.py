@@ -0,0 +1,294 @@
+from .llm_engine import mock_fields
+from .response_cache import ResponseCache, cache_key, sha256
+from .usage import UsageTracker, usage_from_response
+from .metrics.batching import approx_tokens
+from dotenv import load_dotenv
+from tqdm import tqdm
+import json
+import os
+import shutil
+import time
+load_dotenv('.env')
+
+BATCH_DIR = 'output/batches'
+POLL_INTERVAL = 30 # seconds between two status checks of a provider batch job
+
+
+def response_format_param(response_format):
+    # structured output as a plain JSON schema (the batch endpoints cannot take the pydantic class)
+    schema = response_format.model_json_schema()
+    for object_schema in [schema, *schema.get('$defs', {}).values()]:
+        object_schema['additionalProperties'] = False
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": response_format.__name__, "schema": schema, "strict": True}
+    }
+
+
+def chat_body(prompt, response_format):
+    return {
+        "messages": [
+            {"role": "user", "content": prompt}
+        ],
+        "response_format": response_format_param(response_format)
+    }
+
+
+class OpenAIBatchBackend:
+    name = 'openai'
+
+    def __init__(self):
+        from openai import OpenAI
+        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+    def request_line(self, custom_id, model, prompt, response_format):
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {"model": model, **chat_body(prompt, response_format)}
+        }
+
+    def submit(self, path, model):
+        with open(path, 'rb') as f:
+            input_file = self.client.files.create(file=f, purpose='batch')
+        return self.client.batches.create(
+            input_file_id=input_file.id, endpoint='/v1/chat/completions', completion_window='24h'
+        ).id
+
+    def status(self, job_id):
+        status = self.client.batches.retrieve(job_id).status
+        if status == 'completed':
+            return 'completed'
+        if status in ('failed', 'expired', 'cancelled'):
+            return 'failed'
+        return 'running'
+
+    def results(self, job_id):
+        output_file_id = self.client.batches.retrieve(job_id).output_file_id
+        return self.client.files.content(output_file_id).text.splitlines()
+
+
+class MistralBatchBackend:
+    name = 'mistral'
+
+    def __init__(self):
+        from mistralai import Mistral
+        self.client = Mistral(api_key=os.getenv("MISTRAL_API_KEY"))
+
+    def request_line(self, custom_id, model, prompt, response_format):
+        # the model is set on the job, not per request
+        return {"custom_id": custom_id, "body": chat_body(prompt, response_format)}
+
+    def submit(self, path, model):
+        with open(path, 'rb') as f:
+            input_file = self.client.files.upload(
+                file={"file_name": os.path.basename(path), "content": f.read()}, purpose='batch'
+            )
+        return self.client.batch.jobs.create(
+            input_files=[input_file.id], model=model, endpoint='/v1/chat/completions'
+        ).id
+
+    def status(self, job_id):
+        status = self.client.batch.jobs.get(job_id=job_id).status
+        if status == 'SUCCESS':
+            return 'completed'
+        if status in ('FAILED', 'TIMEOUT_EXCEEDED', 'CANCELLED'):
+            return 'failed'
+        return 'running'
+
+    def results(self, job_id):
+        output_file = self.client.batch.jobs.get(job_id=job_id).output_file
+        return self.client.files.download(file_id=output_file).read().decode('utf-8').splitlines()
+
+
+class FakeBatchBackend:
+    # file-based stand-in for the provider batch endpoints: a job is a directory under `root`,
+    # completed after `polls` status checks with the same answers as the mock provider
+    name = 'mock'
+
+    def __init__(self, root=os.path.join(BATCH_DIR, 'fake'), polls=1):
+        self.root = root
+        self.polls = polls
+
+    def request_line(self, custom_id, model, prompt, response_format):
+        return {"custom_id": custom_id, "body": {"model": model, **chat_body(prompt, response_format)}}
+
+    def submit(self, path, model):
+        job_id = f"fake-{time.time_ns()}"
+        os.makedirs(os.path.join(self.root, job_id))
+        shutil.copy(path, os.path.join(self.root, job_id, 'input.jsonl'))
+        return job_id
+
+    def status(self, job_id):
+        job_dir = os.path.join(self.root, job_id)
+        polls_path = os.path.join(job_dir, 'polls')
+        polls = 1
+        if os.path.exists(polls_path):
+            with open(polls_path, 'r') as f:
+                polls += int(f.read())
+        with open(polls_path, 'w') as f:
+            f.write(str(polls))
+        if polls < self.polls:
+            return 'running'
+
+        output_path = os.path.join(job_dir, 'output.jsonl')
+        if not os.path.exists(output_path):
+            with open(os.path.join(job_dir, 'input.jsonl'), 'r', encoding='utf-8') as src, \
+                    open(output_path, 'w', encoding='utf-8') as out:
+                for line in src:
+                    request = json.loads(line)
+                    body = request['body']
+                    prompt = body['messages'][-1]['content']
+                    content = json.dumps(mock_fields(prompt, body['response_format']['json_schema']['schema']))
+                    usage = {"prompt_tokens": approx_tokens(prompt), "completion_tokens": approx_tokens(content)}
+                    out.write(json.dumps({
+                        "custom_id": request['custom_id'],
+                        "response": {"status_code": 200, "body": {
+                            "choices": [{"message": {"role": "assistant", "content": content}}],
+                            "usage": usage
+                        }},
+                        "error": None
+                    }) + '\n')
+        return 'completed'
+
+    def results(self, job_id):
+        with open(os.path.join(self.root, job_id, 'output.jsonl'), 'r', encoding='utf-8') as f:
+            return f.read().splitlines()
+
+
+BATCH_BACKENDS = {
+    'openai': OpenAIBatchBackend,
+    'mistral': MistralBatchBackend,
+    'mock': FakeBatchBackend,
+}
+
+
+def get_batch_backend(provider_name):
+    if provider_name not in BATCH_BACKENDS:
+        raise ValueError(f"No batch API for provider: {provider_name}. Available: {', '.join(BATCH_BACKENDS)}")
+    return BATCH_BACKENDS[provider_name]()
+
+
+def parse_line(line, response_format):
+    # one output line of a batch job -> parsed response (None if the request failed)
+    record = json.loads(line)
+    response = record.get('response') or {}
+    if record.get('error') or response.get('status_code') != 200:
+        return None
+    try:
+        content = response['body']['choices'][0]['message']['content']
+        return response_format.model_validate_json(content)
+    except Exception as exc:
+        print(f"Unparsable batch response {record.get('custom_id')}: {type(exc).__name__}: {exc}")
+        return None
+
+
+class BatchRunner:
+    # offline alternative to JudgeEngine.run for runs where latency does not matter: uncached requests
+    # are written to one JSONL file, submitted as a single provider batch job, polled, and mapped back
+    # to request order. The job id is kept next to the input file, so a killed run resumes polling
+    # the same job instead of paying for a new one
+
+    def __init__(self, backend, cache=None, root=BATCH_DIR, poll_interval=POLL_INTERVAL, usage=None):
+        self.backend = backend
+        self.cache = cache or ResponseCache(enabled=False)
+        self.usage = usage or UsageTracker()
+        self.root = root
+        self.poll_interval = poll_interval
+        self.jobs = 0
+        self.submitted = 0
+        self.failed = 0
+        self.turnaround = 0.0
+
+    def _wait(self, job_id, desc):
+        start = time.monotonic()
+        with tqdm(desc=f'{desc} (batch {job_id})', leave=False, bar_format='{desc}: {elapsed}') as pbar:
+            while True:
+                status = self.backend.status(job_id)
+                if status != 'running':
+                    return status, time.monotonic() - start
+                time.sleep(self.poll_interval)
+                pbar.refresh()
+
+    def run(self, model, requests, desc='Judging', on_result=None, label=None):
+        # same contract as JudgeEngine.run: (prompt, response_format) tuples in, parsed results (or None) out
+        results = [None] * len(requests)
+        keys = [cache_key(self.backend.name, model, None, response_format, prompt) for prompt, response_format in requests]
+        pending = []
+        for index, ((prompt, response_format), key) in enumerate(zip(requests, keys)):
+            results[index] = self.cache.get(key, response_format)
+            if results[index] is None:
+                pending.append(index)
+            elif on_result is not None:
+                on_result(index, results[index])
+        if not pending:
+            return results
+
+        lines = [
+            json.dumps(self.backend.request_line(str(index), model, *requests[index]), ensure_ascii=False)
+            for index in pending
+        ]
+        content = '\n'.join(lines) + '\n'
+        name = f"{self.backend.name}-{sha256(model + content)[:16]}"
+        os.makedirs(self.root, exist_ok=True)
+        input_path = os.path.join(self.root, f'{name}.jsonl')
+        job_path = os.path.join(self.root, f'{name}.job.json')
+        with open(input_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+
+        if os.path.exists(job_path):
+            with open(job_path, 'r') as f:
+                job_id = json.load(f)['job_id']
+            print(f"Resuming batch job {job_id} ({len(pending)} requests)")
+        else:
+            job_id = self.backend.submit(input_path, model)
+            with open(job_path, 'w') as f:
+                json.dump({"job_id": job_id, "model": model, "requests": len(pending)}, f)
+            print(f"Submitted batch job {job_id} ({len(pending)} requests)")
+        self.jobs += 1
+        self.submitted += len(pending)
+
+        status, elapsed = self._wait(job_id, desc)
+        self.turnaround += elapsed
+        if status != 'completed':
+            # like a request that exhausted its retries in JudgeEngine: the items of this job stay unscored
+            # and the run goes on. The job file is dropped, so that the next run submits a new job
+            print(f"Batch job {job_id} {status}: {len(pending)} requests left unscored")
+            os.remove(job_path)
+            self.failed += len(pending)
+            if on_result is not None:
+                for index in pending:
+                    on_result(index, None)
+            return results
+
+        received = set()
+        for line in self.backend.results(job_id):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            index = int(record['custom_id'])
+            prompt, response_format = requests[index]
+            results[index] = parse_line(line, response_format)
+            received.add(index)
+            # tokens are billed at the batch discount; a batched request has no latency of its own
+            # (the job turnaround is in summary())
+            self.usage.record(
+                label or desc, model, usage_from_response((record.get('response') or {}).get('body')),
+                None, ok=results[index] is not None, batch=True
+            )
+            if results[index] is None:
+                self.failed += 1
+            else:
+                self.cache.put(keys[index], self.backend.name, model, prompt, results[index], elapsed / len(pending))
+            if on_result is not None:
+                on_result(index, results[index])
+        self.failed += len(set(pending) - received)
+        os.remove(job_path)
+        return results
+
+    def summary(self):
+        return (
+            f"{self.jobs} batch jobs, {self.submitted} requests submitted, {self.failed} failed, "
+            f"{self.turnaround:.0f}s total turnaround"
+        )
@@ -0,0 +1,106 @@
+from concurrent.futures import ProcessPoolExecutor
+from .evaluation import to_array, f1_from_counts
+import numpy as np
+
+STATS = ['continuous', 'f1', 'accuracy', 'best_f1', 'threshold']
+
+
+def replicate_stats(idx, expected_continuous, expected_binary, scores, result_binary):
+    # idx: (B, n) resampled item indexes, one bootstrap replicate per row
+    n_resamples = idx.shape[0]
+    rows = np.arange(n_resamples)
+
+    # continuous agreement, averaged over the scored items of each replicate
+    agreement = 1 - np.abs(expected_continuous - scores)
+    valid = ~np.isnan(agreement)
+    count = valid[idx].sum(axis=1)
+    total = np.where(valid, agreement, 0.0)[idx].sum(axis=1)
+    continuous = np.divide(total, count, out=np.zeros(n_resamples), where=count > 0)
+
+    # F1 / accuracy of the stored binary predictions
+    labeled = ~np.isnan(expected_binary) & ~np.isnan(result_binary)
+    t = labeled & (expected_binary == 1)
+    p = labeled & (result_binary == 1)
+    tp = (t & p)[idx].sum(axis=1)
+    fp = (~t & p)[idx].sum(axis=1)
+    fn = (t & ~p & labeled)[idx].sum(axis=1)
+    n_labeled = labeled[idx].sum(axis=1)
+    tn = n_labeled - tp - fp - fn
+    accuracy = np.divide(tp + tn, n_labeled, out=np.zeros(n_resamples), where=n_labeled > 0)
+    f1 = f1_from_counts(tp, fp, fn)
+
+    # best-F1 threshold chosen again on each replicate (same rule as evaluation.compute_best_threshold)
+    usable = ~np.isnan(scores) & ~np.isnan(expected_binary)
+    s = np.where(usable, scores, -np.inf)[idx]
+    order = np.argsort(-s, axis=1, kind='stable')
+    s = np.take_along_axis(s, order, axis=1)
+    positives = np.take_along_axis((usable & (expected_binary == 1))[idx], order, axis=1)
+    n_usable = usable[idx].sum(axis=1)
+    total_pos = positives.sum(axis=1)
+
+    tp_prefix = np.cumsum(positives, axis=1)
+    precision = tp_prefix / np.arange(1, idx.shape[1] + 1)
+    recall = np.divide(tp_prefix, total_pos[:, None], out=np.zeros(tp_prefix.shape), where=total_pos[:, None] > 0)
+    denom = precision + recall
+    prefix_f1 = np.divide(2 * precision * recall, denom, out=np.zeros(denom.shape), where=denom > 0)
+    # unusable items are sorted last (score -inf) and never a valid cutoff
+    prefix_f1[np.arange(idx.shape[1])[None, :] >= n_usable[:, None]] = -1.0
+
+    best_idx = np.argmax(prefix_f1, axis=1)
+    best_f1 = prefix_f1[rows, best_idx]
+    next_idx = np.minimum(best_idx + 1, idx.shape[1] - 1)
+    threshold = np.where(
+        best_idx < n_usable - 1,
+        (s[rows, best_idx] + s[rows, next_idx]) / 2,
+        s[rows, best_idx] - 1e-6
+    )
+    degenerate = (n_usable == 0) | (total_pos == 0)
+    best_f1 = np.where(degenerate, 0.0, best_f1)
+    threshold = np.where(degenerate, 0.5, threshold)
+
+    return np.stack([continuous, f1, accuracy, best_f1, threshold], axis=1)
+
+
+def _run_chunk(args):
+    seed, n_resamples, arrays = args
+    n = arrays[0].shape[0]
+    idx = np.random.default_rng(seed).integers(0, n, size=(n_resamples, n))
+    return replicate_stats(idx, *arrays)
+
+
+def bootstrap_ci(expected_continuous, expected_binary, scores, result_binary, n_resamples=1000, confidence=0.95, seed=0, workers=1, chunk_size=250):
+    # percentile confidence intervals for the summary statistics, resampling items with replacement
+    arrays = tuple(to_array(values) for values in (expected_continuous, expected_binary, scores, result_binary))
+    if arrays[0].size == 0:
+        return {stat: (0.0, 0.0) for stat in STATS}
+
+    # fixed-size chunks bound memory to (chunk_size x n) per array; seeds make the result independent of `workers`
+    sizes = [min(chunk_size, n_resamples - start) for start in range(0, n_resamples, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(s, size, arrays) for s, size in zip(seeds, sizes)]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunks = list(pool.map(_run_chunk, tasks))
+    else:
+        chunks = [_run_chunk(task) for task in tasks]
+    replicates = np.concatenate(chunks, axis=0)
+
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(replicates, [alpha, 1 - alpha], axis=0)
+    return {stat: (float(l), float(h)) for stat, l, h in zip(STATS, low, high)}
+
+
+def bootstrap_results(results, continuous_key, binary_key, **kwargs):
+    return bootstrap_ci(
+        [res['expected_continuous'] for res in results],
+        [res['expected_binary'] for res in results],
+        [res[continuous_key] for res in results],
+        [res[binary_key] for res in results],
+        **kwargs
+    )
+
+
+def format_ci(ci, confidence=0.95):
+    return f"CI{round(confidence * 100)} | " + " | ".join(
+        f"{stat}: [{low:.4f}, {high:.4f}]" for stat, (low, high) in ci.items()
+    )
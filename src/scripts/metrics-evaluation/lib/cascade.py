@@ -0,0 +1,164 @@
+from .evaluation import compute_best_threshold, binarize, summarize, to_array
+from .results_stream import read_results
+from collections import Counter, defaultdict
+import numpy as np
+import json
+import sys
+
+# results of metrics_assessment.py the cheap metric is read from (results.jsonl for --stream runs)
+CASCADE_RESULTS = 'output/evaluations/metrics/v2/results.json'
+CASCADE_REF_MODE = 'full'
+# half-width of the uncertainty band around the cheap metric threshold: only items inside it reach the judge
+CASCADE_BAND = 0.1
+BAND_SWEEP = [0.0, 0.05, 0.1, 0.15, 0.2, 0.3, 0.5, 1.0]
+# top of each judge metric's score scale (see llm_metrics_prompts): a confident cheap verdict is 0 or the top
+# (both scores for llm_main_sub)
+JUDGE_SCALES = {'llm_full': 1, 'llm_main': 4, 'llm_sub': 4, 'llm_main_sub': 4}
+
+
+def load_results(path):
+    if path.endswith('.jsonl'):
+        return read_results(path)
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def aligned_rows(results, metric, dataset_rows):
+    # rows of `metric` in dataset order; results of an older version of the dataset are refused
+    if metric not in results['metrics']:
+        raise ValueError(f"Metric {metric} not found. Available: {', '.join(results['metrics'])}")
+    rows = results['metrics'][metric]
+    keys = [(row['group'], row['candidate']) for row in rows]
+    if keys != [(row['group'], row['candidate']) for row in dataset_rows]:
+        raise ValueError(f"Results of {metric} do not match the current metrics tests, score them again")
+    return rows
+
+
+def cheap_scores(dataset, metric, path=CASCADE_RESULTS, ref_mode=CASCADE_REF_MODE):
+    # normalized scores of a local metric, in dataset order, with its best-F1 threshold
+    results = load_results(path)
+    rows = aligned_rows(results, metric, [dataset.row(item) for item in dataset])
+    return [row[f'result_continuous_{ref_mode}ref'] for row in rows], results['meta'][metric][f'threshold_{ref_mode}']
+
+
+def band_verdicts(scores, threshold, band):
+    # 1.0 / 0.0 where the cheap metric is confident (farther than `band` from its threshold), NaN where uncertain
+    scores = to_array(scores)
+    verdicts = np.where(scores > threshold, 1.0, 0.0)
+    verdicts[np.isnan(scores) | (np.abs(scores - threshold) <= band)] = np.nan
+    return verdicts
+
+
+class ZeroMainRule:
+    # an answer judged 0 on llm_main gets 0 on llm_sub without a judge call
+    name = 'llm_main=0'
+
+    def __init__(self):
+        self.zero = set()
+
+    def observe(self, metric_type, item, score):
+        if metric_type == 'llm_main' and score == 0:
+            self.zero.add(item.candidate_id)
+
+    def decide(self, metric_type, item):
+        return 0 if metric_type == 'llm_sub' and item.candidate_id in self.zero else None
+
+
+class CheapMetricRule:
+    # a cheap local metric settles the items it is confident about, for every judge metric
+
+    def __init__(self, metric, scores, threshold, band=CASCADE_BAND):
+        self.name = f'{metric} ±{band}'
+        self.verdicts = band_verdicts(scores, threshold, band)
+
+    def observe(self, metric_type, item, score):
+        pass
+
+    def decide(self, metric_type, item):
+        verdict = self.verdicts[item.index]
+        return None if np.isnan(verdict) else float(verdict * JUDGE_SCALES[metric_type])
+
+
+class Cascade:
+    # rules are tried in order: the first one returning a score settles the item, otherwise it goes to the judge
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.decided = defaultdict(Counter) # metric type -> rule name -> items
+        self.judged = Counter()
+
+    def decide(self, metric_type, item):
+        for rule in self.rules:
+            score = rule.decide(metric_type, item)
+            if score is not None:
+                self.decided[metric_type][rule.name] += 1
+                return score
+        self.judged[metric_type] += 1
+        return None
+
+    def observe(self, metric_type, item, score):
+        for rule in self.rules:
+            rule.observe(metric_type, item, score)
+
+    def summary(self):
+        lines = []
+        for metric_type in dict.fromkeys([*self.judged, *self.decided]):
+            decided = sum(self.decided[metric_type].values())
+            rules = ', '.join(f"{name}: {count}" for name, count in self.decided[metric_type].items())
+            lines.append(
+                f"  {metric_type:<20} {decided}/{decided + self.judged[metric_type]} decided without the judge"
+                + (f" ({rules})" if rules else "")
+            )
+        decided = sum(sum(counts.values()) for counts in self.decided.values())
+        total = decided + sum(self.judged.values())
+        rate = decided / total if total else 0.0
+        return '\n'.join([f"Cascade: {decided}/{total} judge calls saved ({rate:.1%})", *lines])
+
+
+def sweep(scores, threshold, judge_metric, judge_scores, expected_continuous, expected_binaries, bands=BAND_SWEEP):
+    # what each band would have given, from a run where the judge scored every item:
+    # calls saved, agreement with the judge-only verdicts and F1 / continuous score against the labels
+    # scores are brought to 0-1 (the scale of the expected scores) so the continuous score is comparable across metrics
+    judge = to_array(judge_scores) / JUDGE_SCALES[judge_metric]
+    judge_binaries = binarize(judge, compute_best_threshold(judge, expected_binaries)[0])
+    rows = []
+    for band in bands:
+        verdicts = band_verdicts(scores, threshold, band)
+        cascade_scores = np.where(np.isnan(verdicts), judge, verdicts)
+        cascade_scores = [None if np.isnan(s) else float(s) for s in cascade_scores]
+        cascade_binaries = binarize(cascade_scores, compute_best_threshold(cascade_scores, expected_binaries)[0])
+        pairs = [(c, j) for c, j in zip(cascade_binaries, judge_binaries) if c is not None and j is not None]
+        summary = summarize(expected_continuous, expected_binaries, cascade_scores, cascade_binaries)
+        rows.append({
+            "band": band,
+            "judge_calls": int(np.isnan(verdicts).sum()),
+            "saved": float((~np.isnan(verdicts)).mean()),
+            "agreement": sum(c == j for c, j in pairs) / len(pairs) if pairs else 0.0,
+            "f1": summary['f1'],
+            "continuous": summary['continuous'],
+        })
+    return rows
+
+
+if __name__ == "__main__":
+    # e.g. python -m lib.cascade paraphrase_miniLM output/evaluations/metrics/v2/results-gpt-5-openai-v=1-llm.json [llm_full]
+    # band sweep of a cheap metric (from CASCADE_RESULTS) in front of a judge metric scored on every item
+    cheap_metric, judge_path = sys.argv[1], sys.argv[2]
+    judge_metric = sys.argv[3] if len(sys.argv) > 3 else 'llm_full'
+    judge_rows = load_results(judge_path)['metrics'][judge_metric]
+    cheap = load_results(CASCADE_RESULTS)
+    cheap_rows = aligned_rows(cheap, cheap_metric, judge_rows)
+    scores = [row[f'result_continuous_{CASCADE_REF_MODE}ref'] for row in cheap_rows]
+    threshold = cheap['meta'][cheap_metric][f'threshold_{CASCADE_REF_MODE}']
+
+    expected_continuous = [row['expected_continuous'] for row in judge_rows]
+    expected_binaries = [row['expected_binary'] for row in judge_rows]
+    judge_scores = [row['result_continuous'] for row in judge_rows]
+    judge_only = summarize(expected_continuous, expected_binaries, to_array(judge_scores) / JUDGE_SCALES[judge_metric], [row['result_binary'] for row in judge_rows])
+    print(f"Cheap metric: {cheap_metric} (threshold {threshold:.4f}) | Judge: {judge_metric} "
+          f"(F1 {judge_only['f1']:.4f}, continuous {judge_only['continuous']:.4f}, {len(judge_rows)} calls)")
+    for row in sweep(scores, threshold, judge_metric, judge_scores, expected_continuous, expected_binaries):
+        print(
+            f"Band: ±{row['band']:<5} | Judge calls: {row['judge_calls']:>4} | Saved: {row['saved']:.1%} | "
+            f"Agreement: {row['agreement']:.4f} | F1: {row['f1']:.4f} | Continuous: {row['continuous']:.4f}"
+        )
@@ -0,0 +1,44 @@
+import hashlib
+import json
+import os
+
+
+def content_hash(*texts):
+    # part of every journal key: an item whose texts changed since the journaled run is scored again
+    return hashlib.sha1('\x1f'.join('' if text is None else text for text in texts).encode('utf-8')).hexdigest()[:16]
+
+
+class Journal:
+    # append-only JSONL checkpoint: one {"key": [...], "value": ...} line per completed item.
+    # Keys are tuples such as (metric, group, candidate index, ref mode, content hash of the scored texts);
+    # the last line of a key wins.
+
+    def __init__(self, path, resume=True):
+        self.path = path
+        self.records = {}
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        if resume and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # last line of a killed run
+                        continue
+                    self.records[tuple(record['key'])] = record['value']
+            print(f"Resuming from {path}: {len(self.records)} completed items")
+        self.file = open(path, 'a' if resume else 'w', encoding='utf-8')
+
+    def __contains__(self, key):
+        return key in self.records
+
+    def get(self, key):
+        return self.records.get(key)
+
+    def record(self, key, value):
+        self.records[key] = value
+        self.file.write(json.dumps({"key": list(key), "value": value}, ensure_ascii=False, default=float) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
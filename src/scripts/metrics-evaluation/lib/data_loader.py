@@ -1,10 +1,19 @@
 import os
 import pandas as pd
+import numpy as np
+import hashlib
 import json
 
 METRICS_SOURCE_CSV = "local/Metriche LM - Groups + Metrics.csv"
 METRICS_DESTINATION_JSON = "data/metrics-evaluation.json"
 EVALUATION_PROMPTS_JSON = 'data/evaluation-prompts.json'
+# prompt-optimization tests of one language (prompt_assessment.py):
+# {group: {"Test", "Keywords", "Reference", "Candidates": [{"Candidate", "Expected", "Binary", "Weight"}]}}
+PROMPT_OPTIMIZATION_JSON = 'data/prompt-optimization/metrics-evaluation-{lang}.json'
+# row hashes of the last converted CSV, to merge only new or changed tests into the json
+METRICS_HASHES_JSON = "output/cache/metrics-evaluation.hashes.json"
+# binary copy of the json for fast repeated loads (optional: needs msgpack)
+METRICS_SNAPSHOT = "output/cache/metrics-evaluation.msgpack"
 
 def load_prompts():
     if not os.path.exists(EVALUATION_PROMPTS_JSON):
@@ -12,48 +21,148 @@ def load_prompts():
 
     with open(EVALUATION_PROMPTS_JSON, 'r') as f:
         return json.loads(f.read())
-    
+
+
+def load_prompt_optimization_tests(lang):
+    path = PROMPT_OPTIMIZATION_JSON.format(lang=lang)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Prompt optimization tests JSON file not found: {path}")
+    return read_json(path)
+
+
+def file_sha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def read_json(path, default=None):
+    if not os.path.exists(path):
+        return default
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_json(path, data, **kwargs):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, **kwargs)
+
+
+def optional_column(series, cast):
+    # whole-column conversion: NaN -> None, values -> python int / float
+    values = pd.to_numeric(series)
+    if cast is int:
+        values = values.astype("Int64")
+    return values.astype(object).where(series.notna(), None).tolist()
+
+
+def test_key(group, test, n_tests):
+    # a group with a single test keeps its name; the tests of a multi-test group are keyed by their content,
+    # "<group>#<sha1 of the test>", so that reordering the CSV does not reassign keys
+    if n_tests == 1:
+        return group
+    return f"{group}#{hashlib.sha1(test.encode('utf-8')).hexdigest()[:8]}"
+
+
+def csv_tests(df):
+    # {key: (row hash, test)} for every (Group, Test) of the CSV; rows without a group or a test are dropped
+    df = df[df["Group"].notna() & df["Test"].notna()].reset_index(drop=True)
+    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    df["KeyRef"] = df["KeyRef"].where(df["KeyRef"].notna(), "")
+    columns = {
+        "Candidate": df["Candidate"].tolist(),
+        "MainCategory": optional_column(df["Main Category"], int),
+        "SubCategory": optional_column(df["Sub Category"], int),
+        "Continuous": optional_column(df["Continuous"], float),
+        "Binary": optional_column(df["Binary (unit test)"], int),
+    }
+    candidates = [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+    tests = {}
+    for group, g in df.groupby("Group", sort=True):
+        group_tests = sorted(g["Test"].unique())
+        for test in group_tests:
+            rows = g.index[g["Test"] == test].to_numpy()
+            key = test_key(group, test, len(group_tests))
+            entry = {
+                "Test": test,
+                "FullRef": df.at[rows[0], "FullRef"],
+                "KeyRef": df.at[rows[0], "KeyRef"],
+                "Candidates": [candidates[i] for i in rows]
+            }
+            if key != group:
+                entry = {"Group": group, **entry}
+            tests[key] = (hashlib.sha256(np.ascontiguousarray(row_hashes[rows]).tobytes()).hexdigest(), entry)
+    return tests
+
+
+def load_snapshot():
+    # the snapshot is only used while it matches the json it was made from
+    try:
+        import msgpack
+    except ImportError:
+        return None
+    if not os.path.exists(METRICS_SNAPSHOT) or not os.path.exists(METRICS_DESTINATION_JSON):
+        return None
+    with open(METRICS_SNAPSHOT, "rb") as f:
+        snapshot = msgpack.unpackb(f.read())
+    stat = os.stat(METRICS_DESTINATION_JSON)
+    if snapshot.get("source") != [stat.st_mtime_ns, stat.st_size]:
+        return None
+    return snapshot["tests"]
+
+
+def save_snapshot(grouped):
+    try:
+        import msgpack
+    except ImportError:
+        return
+    stat = os.stat(METRICS_DESTINATION_JSON)
+    os.makedirs(os.path.dirname(METRICS_SNAPSHOT), exist_ok=True)
+    with open(METRICS_SNAPSHOT, "wb") as f:
+        f.write(msgpack.packb({"source": [stat.st_mtime_ns, stat.st_size], "tests": grouped}))
+
 
 def load_metrics_tests():
 
-    # se esiste il json e non c'è il csv, ritorna il json
-    if os.path.exists(METRICS_DESTINATION_JSON) and not os.path.exists(METRICS_SOURCE_CSV):
-        with open(METRICS_DESTINATION_JSON, "r", encoding="utf-8") as f:
-            return json.load(f)
-    
-    # se non esiste il csv, solleva un errore
-    if not os.path.exists(METRICS_SOURCE_CSV):
+    # se non ci sono né json né csv, solleva un errore
+    if not os.path.exists(METRICS_DESTINATION_JSON) and not os.path.exists(METRICS_SOURCE_CSV):
         raise FileNotFoundError(f"Source CSV file not found: {METRICS_SOURCE_CSV}")
-    
-    # else -> aggiorna il json con il contenuto del csv
-    
-    df = pd.read_csv(METRICS_SOURCE_CSV)
-    df = df.dropna(how="all")
-
-    grouped = {}
-    for (group, test), g in df.groupby(["Group", "Test"]):
-        full_ref = g["FullRef"].iloc[0]
-        key_ref = g["KeyRef"].iloc[0] if pd.notna(g["KeyRef"].iloc[0]) else ""
-
-        candidates = []
-        for _, row in g.iterrows():
-            candidates.append({
-                "Candidate": row["Candidate"],
-                "MainCategory": int(row["Main Category"]) if pd.notna(row["Main Category"]) else None,
-                "SubCategory": int(row["Sub Category"]) if pd.notna(row["Sub Category"]) else None,
-                "Continuous": float(row["Continuous"]) if pd.notna(row["Continuous"]) else None,
-                "Binary": int(row["Binary (unit test)"]) if pd.notna(row["Binary (unit test)"]) else None
-            })
-
-        grouped[group] = {
-            "Test": test,
-            "FullRef": full_ref,
-            "KeyRef": key_ref,
-            "Candidates": candidates
-        }
-
-    with open(METRICS_DESTINATION_JSON, "w", encoding="utf-8") as f:
-        json.dump(grouped, f, ensure_ascii=False, indent=2)
-
-    os.remove(METRICS_SOURCE_CSV)
-    return grouped
\ No newline at end of file
+
+    # se c'è il csv -> aggiorna il json con i test nuovi o modificati
+    if os.path.exists(METRICS_SOURCE_CSV):
+        hashes = read_json(METRICS_HASHES_JSON, {})
+        csv_hash = file_sha256(METRICS_SOURCE_CSV)
+        if hashes.get("csv") != csv_hash or not os.path.exists(METRICS_DESTINATION_JSON):
+            df = pd.read_csv(METRICS_SOURCE_CSV)
+            df = df.dropna(how="all")
+
+            grouped = read_json(METRICS_DESTINATION_JSON, {})
+            test_hashes = hashes.get("tests", {})
+            tests = csv_tests(df)
+            changed = 0
+            for key, (row_hash, entry) in tests.items():
+                if test_hashes.get(key) != row_hash or key not in grouped:
+                    grouped[key] = entry
+                    test_hashes[key] = row_hash
+                    changed += 1
+            # the CSV is the source of truth: tests deleted from it leave the json too
+            removed = [key for key in grouped if key not in tests]
+            for key in removed:
+                del grouped[key]
+                test_hashes.pop(key, None)
+            # same key order as a full conversion
+            grouped = {key: grouped[key] for key in tests}
+
+            if changed or removed:
+                print(f"Updating {METRICS_DESTINATION_JSON}: {changed} new or changed tests, {len(removed)} removed")
+                write_json(METRICS_DESTINATION_JSON, grouped, ensure_ascii=False, indent=2)
+                save_snapshot(grouped)
+            write_json(METRICS_HASHES_JSON, {"csv": csv_hash, "tests": test_hashes})
+            return grouped
+
+    grouped = load_snapshot()
+    if grouped is None:
+        grouped = read_json(METRICS_DESTINATION_JSON)
+        save_snapshot(grouped)
+    return grouped
@@ -0,0 +1,125 @@
+from .data_loader import load_metrics_tests
+
+REF_MODES = ['full', 'key']
+
+
+class TextTable:
+    # interned strings: every distinct text is stored once and referenced by its integer id
+
+    __slots__ = ('texts', 'ids')
+
+    def __init__(self):
+        self.texts = []
+        self.ids = {}
+
+    def intern(self, text):
+        if text not in self.ids:
+            self.ids[text] = len(self.texts)
+            self.texts.append(text)
+        return self.ids[text]
+
+    def __getitem__(self, text_id):
+        return self.texts[text_id]
+
+    def __len__(self):
+        return len(self.texts)
+
+
+class EvalItem:
+    # one (test, candidate) pair; texts and groups are ids into the dataset tables
+
+    __slots__ = (
+        'index', 'group_id', 'candidate_index', 'test_id', 'full_ref_id', 'key_ref_id', 'candidate_id',
+        'main_cat', 'sub_cat', 'continuous', 'binary', 'weight'
+    )
+
+    def __init__(self, index, group_id, candidate_index, test_id, full_ref_id, key_ref_id, candidate_id,
+                 main_cat, sub_cat, continuous, binary, weight=None):
+        self.index = index
+        self.group_id = group_id
+        self.candidate_index = candidate_index
+        self.test_id = test_id
+        self.full_ref_id = full_ref_id
+        self.key_ref_id = key_ref_id
+        self.candidate_id = candidate_id
+        self.main_cat = main_cat
+        self.sub_cat = sub_cat
+        self.continuous = continuous
+        self.binary = binary
+        self.weight = weight
+
+
+class Dataset:
+    # every (test, candidate) pair of the metrics tests, built once per run and shared by all metrics / trials
+
+    def __init__(self, metrics_tests):
+        self.texts = TextTable()
+        self.groups = TextTable()
+        self.items = []
+        for key, tests in metrics_tests.items():
+            # tests of a multi-test group are keyed "<group>#<hash>" and carry the group name in "Group"
+            group_id = self.groups.intern(tests.get('Group', key))
+            test_id = self.texts.intern(tests['Test'])
+            # prompt-optimization datasets name the reference "Reference" and the expected score "Expected"
+            full_ref_id = self.texts.intern(tests.get('FullRef', tests.get('Reference')))
+            key_ref_id = self.texts.intern(tests.get('KeyRef'))
+            for candidate_index, candidate in enumerate(tests['Candidates']):
+                self.items.append(EvalItem(
+                    len(self.items),
+                    group_id,
+                    candidate_index,
+                    test_id,
+                    full_ref_id,
+                    key_ref_id,
+                    self.texts.intern(candidate['Candidate']),
+                    candidate.get('MainCategory'),
+                    candidate.get('SubCategory'),
+                    candidate.get('Continuous', candidate.get('Expected')),
+                    candidate['Binary'],
+                    candidate.get('Weight')
+                ))
+
+    @classmethod
+    def load(cls):
+        return cls(load_metrics_tests())
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def group(self, item):
+        return self.groups[item.group_id]
+
+    def test(self, item):
+        return self.texts[item.test_id]
+
+    def candidate(self, item):
+        return self.texts[item.candidate_id]
+
+    def reference(self, item, mode='full'):
+        return self.texts[item.full_ref_id if mode == 'full' else item.key_ref_id]
+
+    # column views, in item order
+
+    def references(self, mode='full'):
+        return [self.reference(item, mode) for item in self.items]
+
+    def predictions(self):
+        return [self.texts[item.candidate_id] for item in self.items]
+
+    def expected_binaries(self):
+        return [item.binary for item in self.items]
+
+    def row(self, item):
+        # common leading fields of a result row
+        return {
+            "group": self.group(item),
+            "test": self.test(item),
+            "main_category": item.main_cat,
+            "sub_category": item.sub_cat,
+            "candidate": self.candidate(item),
+            "expected_continuous": item.continuous,
+            "expected_binary": item.binary,
+        }
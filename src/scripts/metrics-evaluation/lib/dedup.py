@@ -0,0 +1,44 @@
+class Deduplicator:
+    # collapses identical work items before they are scored and fans the results back out.
+    # Keys are whatever identifies the result, e.g. (reference, prediction) for a metric or the full
+    # prompt for an LLM judge; stats are kept per name (metric) over the whole run
+
+    def __init__(self):
+        self.stats = {} # name -> [items, unique items]
+
+    def collapse(self, name, keys):
+        # -> (position of the first occurrence of every unique key, unique index of every position)
+        index = {}
+        unique = []
+        inverse = []
+        for position, key in enumerate(keys):
+            if key not in index:
+                index[key] = len(unique)
+                unique.append(position)
+            inverse.append(index[key])
+        stats = self.stats.setdefault(name, [0, 0])
+        stats[0] += len(inverse)
+        stats[1] += len(unique)
+        return unique, inverse
+
+    @staticmethod
+    def fan_out(inverse):
+        # unique index -> every position sharing it
+        positions = [[] for _ in range(max(inverse, default=-1) + 1)]
+        for position, u in enumerate(inverse):
+            positions[u].append(position)
+        return positions
+
+    @staticmethod
+    def expand(values, inverse):
+        return [values[u] for u in inverse]
+
+    def summary(self):
+        total = sum(items for items, _ in self.stats.values())
+        unique = sum(u for _, u in self.stats.values())
+        if not total:
+            return "Dedup: nothing scored"
+        lines = [f"Dedup: {total - unique}/{total} items reused ({(total - unique) / total:.1%}), {unique} scored"]
+        for name, (items, u) in self.stats.items():
+            lines.append(f"  {name:<20} {items - u}/{items} reused ({(items - u) / items:.1%})" if items else f"  {name:<20} -")
+        return '\n'.join(lines)
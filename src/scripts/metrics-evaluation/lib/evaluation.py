@@ -0,0 +1,80 @@
+import numpy as np
+
+
+def to_array(values):
+    # None (unscored / unlabeled) becomes NaN
+    return np.array([np.nan if v is None else v for v in values], dtype=float)
+
+
+def f1_from_counts(tp, fp, fn):
+    precision = np.divide(tp, tp + fp, out=np.zeros_like(tp, dtype=float), where=(tp + fp) > 0)
+    recall = np.divide(tp, tp + fn, out=np.zeros_like(tp, dtype=float), where=(tp + fn) > 0)
+    denom = precision + recall
+    return np.divide(2 * precision * recall, denom, out=np.zeros_like(denom), where=denom > 0)
+
+
+def compute_best_threshold(scores, labels):
+    # best-F1 cutoff: sort by descending score, every prefix is a candidate positive set
+    scores, labels = to_array(scores), to_array(labels)
+    mask = ~np.isnan(scores) & ~np.isnan(labels)
+    scores, labels = scores[mask], labels[mask]
+    if scores.size == 0:
+        return 0.5, 0.0
+    order = np.argsort(-scores, kind='stable')
+    scores, positives = scores[order], labels[order] == 1
+    total_pos = positives.sum()
+    if total_pos == 0:
+        return 0.5, 0.0
+
+    tp = np.cumsum(positives)
+    precision = tp / np.arange(1, scores.size + 1)
+    recall = tp / total_pos
+    denom = precision + recall
+    f1 = np.divide(2 * precision * recall, denom, out=np.zeros_like(denom), where=denom > 0)
+
+    best_idx = int(np.argmax(f1))
+    if best_idx < scores.size - 1:
+        th = (scores[best_idx] + scores[best_idx + 1]) / 2
+    else:
+        th = scores[best_idx] - 1e-6
+    return float(th), float(f1[best_idx])
+
+
+def binarize(scores, threshold):
+    scores = to_array(scores)
+    return [None if np.isnan(s) else int(s >= threshold) for s in scores]
+
+
+def confusion_matrix(y_true, y_pred):
+    y_true, y_pred = to_array(y_true), to_array(y_pred)
+    mask = ~np.isnan(y_true) & ~np.isnan(y_pred)
+    t, p = y_true[mask] == 1, y_pred[mask] == 1
+    return {
+        "tp": int(np.sum(t & p)),
+        "fp": int(np.sum(~t & p)),
+        "fn": int(np.sum(t & ~p)),
+        "tn": int(np.sum(~t & ~p)),
+    }
+
+
+def summarize(expected_continuous, expected_binary, result_continuous, result_binary):
+    # continuous agreement (1 - |expected - score|), binary F1 and accuracy over the scored items
+    expected_continuous, result_continuous = to_array(expected_continuous), to_array(result_continuous)
+    mask = ~np.isnan(expected_continuous) & ~np.isnan(result_continuous)
+    continuous = float(np.mean(1 - np.abs(expected_continuous[mask] - result_continuous[mask]))) if mask.any() else 0.0
+
+    counts = confusion_matrix(expected_binary, result_binary)
+    total = sum(counts.values())
+    accuracy = (counts["tp"] + counts["tn"]) / total if total > 0 else 0.0
+    f1 = float(f1_from_counts(np.array(counts["tp"]), np.array(counts["fp"]), np.array(counts["fn"])))
+
+    return {"continuous": continuous, "f1": f1, "accuracy": accuracy, **counts}
+
+
+def summarize_results(results, continuous_key, binary_key):
+    return summarize(
+        [res['expected_continuous'] for res in results],
+        [res['expected_binary'] for res in results],
+        [res[continuous_key] for res in results],
+        [res[binary_key] for res in results],
+    )
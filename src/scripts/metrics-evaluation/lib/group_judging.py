@@ -0,0 +1,80 @@
+from pydantic import create_model
+from functools import cache
+
+# candidates per grouped call: long groups are split, so answers stay short enough to be reliable
+GROUP_SIZE = 8
+
+
+@cache
+def group_response_format(response_format):
+    # {"evaluations": [{...response_format fields, "candidate_id": int}, ...]}
+    candidate_format = create_model(f'Candidate{response_format.__name__}', __base__=response_format, candidate_id=(int, ...))
+    return create_model(f'Group{response_format.__name__}', evaluations=(list[candidate_format], ...))
+
+
+def map_by_candidate(parsed, n_candidates, response_format):
+    # candidate id -> single-candidate result; ids that are missing, out of range or repeated are left out
+    if parsed is None:
+        return {}
+    ids = [evaluation.candidate_id for evaluation in parsed.evaluations]
+    return {
+        evaluation.candidate_id: response_format.model_validate(evaluation.model_dump(exclude={'candidate_id'}))
+        for evaluation in parsed.evaluations
+        if 0 <= evaluation.candidate_id < n_candidates and ids.count(evaluation.candidate_id) == 1
+    }
+
+
+class GroupJudge:
+    # judges all the candidates of a group in one call and falls back to one call per candidate
+    # for every candidate the grouped answer does not cover (failed call, schema mismatch, missing id)
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.group_calls = 0
+        self.candidates = 0
+        self.fallbacks = 0
+
+    def run(self, model, groups, requests, desc='Judging', on_result=None, label=None):
+        # groups: (prompt, response_format, [request positions]) with candidate id = index in the list;
+        # requests: the single-candidate (prompt, response_format) of every position, used for the fallback
+        results = [None] * len(requests)
+        fallback = []
+
+        def on_group(index, parsed):
+            prompt, response_format, positions = groups[index]
+            by_id = map_by_candidate(parsed, len(positions), response_format)
+            for candidate_id, position in enumerate(positions):
+                if candidate_id not in by_id:
+                    fallback.append(position)
+                    continue
+                results[position] = by_id[candidate_id]
+                if on_result is not None:
+                    on_result(position, results[position])
+
+        self.engine.run(
+            model,
+            [(prompt, group_response_format(response_format)) for prompt, response_format, _ in groups],
+            desc=f'{desc} (grouped)',
+            on_result=on_group,
+            label=f'{label or desc} (grouped)'
+        )
+        self.group_calls += len(groups)
+        self.candidates += len(requests)
+
+        if fallback:
+            fallback.sort()
+            print(f"{len(fallback)} candidates not covered by the grouped answers, judging them one by one")
+            self.fallbacks += len(fallback)
+            singles = self.engine.run(
+                model,
+                [requests[position] for position in fallback],
+                desc=f'{desc} (fallback)',
+                on_result=None if on_result is None else lambda index, parsed: on_result(fallback[index], parsed),
+                label=f'{label or desc} (fallback)'
+            )
+            for position, parsed in zip(fallback, singles):
+                results[position] = parsed
+        return results
+
+    def summary(self):
+        return f"{self.group_calls} grouped calls for {self.candidates} candidates, {self.fallbacks} single-call fallbacks"
@@ -0,0 +1,281 @@
+from .resilience import RequestScheduler, RetryPolicy, is_provider_error
+from .response_cache import ResponseCache, cache_key
+from .usage import UsageTracker, usage_from_response
+from .metrics.batching import approx_tokens
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+from tqdm import tqdm
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+import os
+load_dotenv('.env')
+
+# default request rate per provider (requests per second), overridable with --rps
+RATE_LIMITS = {
+    'openai': 8.0,
+    'mistral': 5.0,
+    'mock': None,
+}
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class OpenAIProvider:
+    name = 'openai'
+
+    def __init__(self):
+        self.client = None
+
+    @asynccontextmanager
+    async def session(self):
+        # one client per event loop: its pooled connections belong to the loop that opened them
+        from openai import AsyncOpenAI
+        async with AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY")) as client:
+            self.client = client
+            try:
+                yield
+            finally:
+                self.client = None
+
+    async def parse(self, model, prompt, response_format):
+        response = await self.client.chat.completions.parse(
+            model=model,
+            messages=[
+                {"role": "user", "content": prompt}
+            ],
+            response_format=response_format
+        )
+        return response.choices[0].message.parsed, usage_from_response(response)
+
+
+class MistralProvider:
+    name = 'mistral'
+
+    def __init__(self):
+        self.client = None
+
+    @asynccontextmanager
+    async def session(self):
+        from mistralai import Mistral
+        async with Mistral(api_key=os.getenv("MISTRAL_API_KEY")) as client:
+            self.client = client
+            try:
+                yield
+            finally:
+                self.client = None
+
+    async def parse(self, model, prompt, response_format):
+        response = await self.client.chat.parse_async(
+            model=model,
+            messages=[
+                {"role": "user", "content": prompt}
+            ],
+            response_format=response_format
+        )
+        return response.choices[0].message.parsed, usage_from_response(response)
+
+
+class MockError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"Mock provider error {status_code}")
+        self.status_code = status_code
+
+
+def mock_fields(prompt, schema, defs=None):
+    # deterministic fake answer for a JSON schema: numbers derived from the prompt hash
+    defs = defs if defs is not None else schema.get('$defs', {})
+    rng = random.Random(hashlib.sha256(prompt.encode('utf-8')).hexdigest())
+    fields = {}
+    for field_name, field in schema['properties'].items():
+        if field.get('type') == 'number':
+            fields[field_name] = round(rng.random(), 1)
+        elif field.get('type') == 'array':
+            # grouped judging: one item per "GIVEN ANSWER (id n)" of the prompt
+            item_schema = defs[field['items']['$ref'].split('/')[-1]]
+            fields[field_name] = [
+                {**mock_fields(f"{prompt}#{candidate_id}", item_schema, defs), 'candidate_id': int(candidate_id)}
+                for candidate_id in re.findall(r"GIVEN ANSWER \(id (\d+)\)", prompt)
+            ]
+        elif field.get('type') == 'integer':
+            fields[field_name] = 0
+        else:
+            fields[field_name] = f"mock {field_name}"
+    return fields
+
+
+class MockProvider:
+    # offline provider for throughput tests: fixed latency, optional 429s, scores derived from the prompt
+    name = 'mock'
+
+    def __init__(self, latency=0.2, failure_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+
+    @asynccontextmanager
+    async def session(self):
+        yield
+
+    async def parse(self, model, prompt, response_format):
+        await asyncio.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise MockError(429)
+        fields = mock_fields(prompt, response_format.model_json_schema())
+        usage = {"prompt_tokens": approx_tokens(prompt), "completion_tokens": approx_tokens(json.dumps(fields)), "cached_tokens": 0}
+        return response_format(**fields), usage
+
+
+PROVIDERS = {
+    'openai': OpenAIProvider,
+    'mistral': MistralProvider,
+    'mock': MockProvider,
+}
+
+
+def get_provider(provider_name):
+    if provider_name not in PROVIDERS:
+        raise ValueError(f"Unknown provider: {provider_name}. Available providers: {', '.join(PROVIDERS)}")
+    return PROVIDERS[provider_name]()
+
+
+class JudgeEngine:
+    # runs many judge requests concurrently; results come back in request order
+
+    def __init__(self, provider, concurrency=16, requests_per_second=None, scheduler=None, cache=None, temperature=None, usage=None):
+        self.provider = provider
+        self.concurrency = concurrency
+        self.requests_per_second = requests_per_second if requests_per_second is not None else RATE_LIMITS.get(provider.name)
+        self.scheduler = scheduler or RequestScheduler(RetryPolicy())
+        self.cache = cache or ResponseCache(enabled=False)
+        # only used for the cache key: providers are called with their default temperature
+        self.temperature = temperature
+        self.usage = usage or UsageTracker()
+
+    async def _request(self, model, prompt, response_format, semaphore, bucket, label):
+        key = cache_key(self.provider.name, model, self.temperature, response_format, prompt)
+        cached = self.cache.get(key, response_format)
+        if cached is not None:
+            return cached
+
+        attempts = 0
+
+        # backoff sleeps happen outside the semaphore, so other requests keep flowing
+        async def attempt():
+            nonlocal attempts
+            attempts += 1
+            async with semaphore:
+                if bucket is not None:
+                    await bucket.acquire()
+                return await self.provider.parse(model, prompt, response_format)
+
+        start = time.monotonic()
+        try:
+            parsed, usage = await self.scheduler.acall(attempt)
+        except Exception as exc:
+            # a request that exhausted its retries (or the provider refused) must not take the whole run
+            # down with it; programming errors still do
+            if not is_provider_error(exc):
+                raise
+            print(f"Request failed permanently ({type(exc).__name__}: {exc})")
+            self.usage.record(label, model, None, time.monotonic() - start, attempts, ok=False)
+            return None
+        latency = time.monotonic() - start
+        self.usage.record(label, model, usage, latency, attempts)
+        self.cache.put(key, self.provider.name, model, prompt, parsed, latency)
+        return parsed
+
+    async def _run(self, model, requests, desc, on_result, label):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        bucket = TokenBucket(self.requests_per_second) if self.requests_per_second else None
+        results = [None] * len(requests)
+
+        # run() starts a new event loop every time: the provider client lives for this run only
+        async with self.provider.session():
+            with tqdm(total=len(requests), desc=desc, leave=False) as pbar:
+                async def run_one(index, prompt, response_format):
+                    results[index] = await self._request(model, prompt, response_format, semaphore, bucket, label)
+                    if on_result is not None:
+                        on_result(index, results[index])
+                    pbar.update(1)
+
+                await asyncio.gather(*(
+                    run_one(index, prompt, response_format)
+                    for index, (prompt, response_format) in enumerate(requests)
+                ))
+        return results
+
+    def run(self, model, requests, desc='Judging', on_result=None, label=None):
+        # requests: list of (prompt, response_format) tuples; failed requests come back as None.
+        # on_result(index, parsed) is called as soon as each request completes;
+        # label groups the calls in the usage report (default: desc)
+        if not requests:
+            return []
+        return asyncio.run(self._run(model, requests, desc, on_result, label or desc))
+
+
+if __name__ == "__main__":
+    # python -m lib.llm_engine: run() twice on the same engine, with the real OpenAI client against a local
+    # server answering every request; the second run must not reuse connections of the first (closed) loop
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from pydantic import BaseModel
+    import sys
+    import threading
+
+    class CheckResult(BaseModel):
+        score: float
+        explanation: str
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1' # keep-alive, so the client pools its connections
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            content = json.dumps({"score": 1.0, "explanation": "ok"})
+            body = json.dumps({
+                "id": "check", "object": "chat.completion", "created": 0, "model": "check",
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            }).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ['OPENAI_BASE_URL'] = f"http://127.0.0.1:{server.server_port}/v1"
+    os.environ['OPENAI_API_KEY'] = 'check'
+
+    engine = JudgeEngine(OpenAIProvider(), requests_per_second=None)
+    requests = [(f"check {i}", CheckResult) for i in range(8)]
+    for run in range(2):
+        scored = sum(result is not None for result in engine.run('check', requests, desc=f'Run {run + 1}'))
+        print(f"run {run + 1}: {scored}/{len(requests)} scored")
+        if scored != len(requests):
+            sys.exit("llm_engine: requests failed on a later run() of the same engine")
+    print("llm_engine: OK")
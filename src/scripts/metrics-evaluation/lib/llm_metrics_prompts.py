@@ -1,3 +1,6 @@
+from .metrics.batching import approx_tokens
+from functools import cache
+
 # 24: No information treatment. 
 
 core_philosophy = """
@@ -19,6 +22,7 @@ Your evaluation process must always follow two steps:
 shallower_reinforcement_on_0 = """Remember: If the given answer include false information, its score is 0."""
 attention_on_0 = """Check every detail of the GIVEN ANSWER and meticoulously compare it to the EXPECTED ANSWERS. A fake information (temporal / factual etc..) lead to a score of 0 [!]."""
 dangerous_info_warning ="""The answers are medically related. If the GIVEN ANSWER contains wrong medical indication with respect to the EXPECTED ANSWERS, the score must be 0."""
+group_instructions = """You will receive SEVERAL GIVEN ANSWERS to the same QUERY, each with its own id. Evaluate every GIVEN ANSWER independently of the others, exactly as if it were the only one, and return one evaluation per GIVEN ANSWER with its candidate_id."""
 attention_on_rephrases = """But, be aware of rephrases: if the GIVEN ANSWER is a rephrase of the EXPECTED ANSWER, it should not be penalized."""
 
 PROMPT_CONFIGS = {
@@ -258,29 +262,12 @@ Scores: 4 (key), 3 (full)
     }
 
 
-def build_prompt(type, query, expected_key_answer, expected_full_answer, provided_answer):
-    if type not in PROMPT_CONFIGS:
-        raise ValueError(f"Unknown prompt type: {type}")
-
-    if type in ["llm_full", "llm_main_sub"] and (expected_key_answer is None or expected_full_answer is None):
-        raise ValueError(f"expected_key_answer and expected_full_answer must be provided for '{type}' prompt type.")
-    if type == "llm_sub" and expected_full_answer is None:
-        raise ValueError(f"expected_full_answer must be provided for 'sub' prompt type.")
-
+@cache
+def prompt_prefix(type):
+    # everything that does not depend on the item, built once per prompt type: every request of a
+    # type starts with the same bytes, so provider-side prompt caching can reuse it
     config = PROMPT_CONFIGS[type]
-
-    input_blocks = [f"QUERY:```\n{query}\n```"]
-    if type in ["llm_full", "llm_main", "llm_main_sub"]:
-        input_blocks.append(f"EXPECTED KEY ANSWER:```\n{expected_key_answer}\n```")
-    if type == "llm_main":
-        input_blocks.append(f"EXPECTED FULL ANSWER (just for context):```\n{expected_full_answer}\n```")
-    elif type in ["llm_full", "llm_sub", "llm_main_sub"]:
-        input_blocks.append(f"EXPECTED FULL ANSWER:```\n{expected_full_answer}\n```")
-
-    input_blocks.append(f"GIVEN ANSWER:```\n{provided_answer}\n```")
-    
-    prompt_template = f"""
-You're an expert evaluator for assessing the correctness of answers provided by a question-answering system. 
+    return f"""You're an expert evaluator for assessing the correctness of answers provided by a question-answering system. 
 
 {core_philosophy}
 
@@ -305,8 +292,53 @@ Instructions:
 
 {attention_on_rephrases}
 
-{''.join(input_blocks)}
-""".strip()
+"""
+
+
+def reference_blocks(type, query, expected_key_answer, expected_full_answer):
+    input_blocks = [f"QUERY:```\n{query}\n```"]
+    if type in ["llm_full", "llm_main", "llm_main_sub"]:
+        input_blocks.append(f"EXPECTED KEY ANSWER:```\n{expected_key_answer}\n```")
+    if type == "llm_main":
+        input_blocks.append(f"EXPECTED FULL ANSWER (just for context):```\n{expected_full_answer}\n```")
+    elif type in ["llm_full", "llm_sub", "llm_main_sub"]:
+        input_blocks.append(f"EXPECTED FULL ANSWER:```\n{expected_full_answer}\n```")
+    return input_blocks
+
+
+def prompt_suffix(type, query, expected_key_answer, expected_full_answer, provided_answer):
+    # the per-item data, always at the end of the prompt
+    input_blocks = reference_blocks(type, query, expected_key_answer, expected_full_answer)
+    input_blocks.append(f"GIVEN ANSWER:```\n{provided_answer}\n```")
+    return ''.join(input_blocks)
+
+
+def check_prompt_args(type, expected_key_answer, expected_full_answer):
+    if type not in PROMPT_CONFIGS:
+        raise ValueError(f"Unknown prompt type: {type}")
+
+    if type in ["llm_full", "llm_main_sub"] and (expected_key_answer is None or expected_full_answer is None):
+        raise ValueError(f"expected_key_answer and expected_full_answer must be provided for '{type}' prompt type.")
+    if type == "llm_sub" and expected_full_answer is None:
+        raise ValueError(f"expected_full_answer must be provided for 'sub' prompt type.")
+
+
+def build_prompt(type, query, expected_key_answer, expected_full_answer, provided_answer):
+    check_prompt_args(type, expected_key_answer, expected_full_answer)
+    return prompt_prefix(type) + prompt_suffix(type, query, expected_key_answer, expected_full_answer, provided_answer)
+
+
+def build_group_prompt(type, query, expected_key_answer, expected_full_answer, provided_answers):
+    # several candidates for the same query and references in one prompt; candidate ids are list indexes
+    check_prompt_args(type, expected_key_answer, expected_full_answer)
+    input_blocks = reference_blocks(type, query, expected_key_answer, expected_full_answer)
+    for candidate_id, provided_answer in enumerate(provided_answers):
+        input_blocks.append(f"GIVEN ANSWER (id {candidate_id}):```\n{provided_answer}\n```")
+    return prompt_prefix(type) + group_instructions + '\n\n' + ''.join(input_blocks)
 
-    return prompt_template
 
+def prompt_token_counts(type, prompts):
+    # approximate (static prefix, mean dynamic suffix) tokens of the prompts built for `type`
+    prefix = prompt_prefix(type)
+    suffixes = [approx_tokens(prompt[len(prefix):]) for prompt in prompts if prompt.startswith(prefix)]
+    return approx_tokens(prefix), (sum(suffixes) / len(suffixes) if suffixes else 0.0)
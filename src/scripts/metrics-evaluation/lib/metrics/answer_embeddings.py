@@ -1,60 +1,106 @@
-from .utils import normalized_01_cosine_similarity
-from mistralai import Mistral
+from .utils import normalized_01_paired_cosine_similarity, lazy
+from .embedding_store import get_embedding_store
+from .batching import bucketed_encode
 from dotenv import load_dotenv
-from sentence_transformers import SentenceTransformer
 import os
 
 load_dotenv(".env")
 
-mistral_client = Mistral(api_key=os.getenv("MISTRAL_API_KEY"))
-paraphrase_miniLM_model = SentenceTransformer(
-    "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2", device="cpu"
-)
-embedding_gemma_model = SentenceTransformer("google/embeddinggemma-300m", device="cpu")
-mmbert_model = SentenceTransformer("jhu-clsp/mmBERT-base", device="cpu")
+MISTRAL_EMBED_BATCH_SIZE = 64
+PARAPHRASE_MINILM_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+EMBEDDING_GEMMA_MODEL = "google/embeddinggemma-300m"
+MMBERT_MODEL = "jhu-clsp/mmBERT-base"
+
+
+
+@lazy
+def mistral_client():
+    from mistralai import Mistral
+
+    return Mistral(api_key=os.getenv("MISTRAL_API_KEY"))
+
+
+def sentence_transformer(model_name):
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(model_name, device="cpu")
+
+
+@lazy
+def paraphrase_miniLM_model():
+    return sentence_transformer(PARAPHRASE_MINILM_MODEL)
+
+
+@lazy
+def embedding_gemma_model():
+    return sentence_transformer(EMBEDDING_GEMMA_MODEL)
+
+
+@lazy
+def mmbert_model():
+    return sentence_transformer(MMBERT_MODEL)
+
+
+def sentence_transformer_encode(model, texts):
+    # length-sorted buckets, each encoded as one padded batch
+    return bucketed_encode(lambda batch, batch_size: model.encode(batch, batch_size=batch_size), texts)
+
+
+def encode_pairs(model_name, encode, references, predictions):
+    # vectors are looked up in the on-disk store first, only unseen texts reach the model;
+    # they come back unit-length, so the similarity is a plain row-wise dot product
+    embeds = get_embedding_store(model_name).encode(references + predictions, encode, normalized=True)
+    return embeds[: len(references)], embeds[len(references) :]
+
+
+def mistral_embed_encode(texts):
+    embeds = []
+    for start in range(0, len(texts), MISTRAL_EMBED_BATCH_SIZE):
+        response = mistral_client().embeddings.create(
+            model="mistral-embed", inputs=texts[start : start + MISTRAL_EMBED_BATCH_SIZE]
+        )
+        embeds.extend(e.embedding for e in response.data)
+    return embeds
 
 
 def mistral_embed(references, predictions):
-    ref_embeds = mistral_client.embeddings.create(
-        model="mistral-embed", inputs=references
-    )
-    ref_embeds = [e.embedding for e in ref_embeds.data]
-    pred_embeds = mistral_client.embeddings.create(
-        model="mistral-embed", inputs=predictions
-    )
-    pred_embeds = [e.embedding for e in pred_embeds.data]
-    return {"similarity": normalized_01_cosine_similarity(ref_embeds, pred_embeds)}
+    ref_embeds, pred_embeds = encode_pairs("mistral-embed", mistral_embed_encode, references, predictions)
+    return {"similarity": normalized_01_paired_cosine_similarity(ref_embeds, pred_embeds, normalized=True)}
 
 
 def paraphrase_miniLM(references, predictions):
-    ref_embeds = paraphrase_miniLM_model.encode(references)
-    pred_embeds = paraphrase_miniLM_model.encode(predictions)
-
-    return {"similarity": normalized_01_cosine_similarity(ref_embeds, pred_embeds)}
+    ref_embeds, pred_embeds = encode_pairs(
+        PARAPHRASE_MINILM_MODEL, lambda texts: sentence_transformer_encode(paraphrase_miniLM_model(), texts), references, predictions
+    )
+    return {"similarity": normalized_01_paired_cosine_similarity(ref_embeds, pred_embeds, normalized=True)}
 
 
 def embedding_gemma(references, predictions):
-    ref_embeds = embedding_gemma_model.encode(references)
-    pred_embeds = embedding_gemma_model.encode(predictions)
-
-    return {"similarity": normalized_01_cosine_similarity(ref_embeds, pred_embeds)}
+    ref_embeds, pred_embeds = encode_pairs(
+        EMBEDDING_GEMMA_MODEL, lambda texts: sentence_transformer_encode(embedding_gemma_model(), texts), references, predictions
+    )
+    return {"similarity": normalized_01_paired_cosine_similarity(ref_embeds, pred_embeds, normalized=True)}
 
 
 def mmbertscore(references, predictions):
-    embeddings_ref = mmbert_model.encode(references)
-    embeddings_pred = mmbert_model.encode(predictions)
-
+    embeddings_ref, embeddings_pred = encode_pairs(
+        MMBERT_MODEL, lambda texts: sentence_transformer_encode(mmbert_model(), texts), references, predictions
+    )
     return {
-        "similarity": normalized_01_cosine_similarity(embeddings_ref, embeddings_pred)
+        "similarity": normalized_01_paired_cosine_similarity(embeddings_ref, embeddings_pred, normalized=True)
     }
 
 
+# batched metrics take whole lists and return one score per (reference, prediction) pair;
+# memory_mb is the approximate footprint of the loaded model (used by the parallel scheduler)
 METRICS = {
-    "mistral-embed": {"function": mistral_embed, "result_key": "similarity"},
-    "paraphrase_miniLM": {"function": paraphrase_miniLM, "result_key": "similarity"},
-    "embedding_gemma": {"function": embedding_gemma, "result_key": "similarity"},
+    "mistral-embed": {"function": mistral_embed, "result_key": "similarity", "batched": True, "shardable": False},
+    "paraphrase_miniLM": {"function": paraphrase_miniLM, "result_key": "similarity", "batched": True, "memory_mb": 600},
+    "embedding_gemma": {"function": embedding_gemma, "result_key": "similarity", "batched": True, "memory_mb": 1500},
     "mmbertscore": {
         "function": mmbertscore,
         "result_key": "similarity",
+        "batched": True,
+        "memory_mb": 1500,
     },
 }
@@ -0,0 +1,70 @@
+import os
+
+# padded tokens per batch for each GB of free RAM (base-size transformers on CPU)
+TOKENS_PER_GB = 4096
+MIN_TOKEN_BUDGET = 2048
+MAX_TOKEN_BUDGET = 65536
+DEFAULT_TOKEN_BUDGET = 8192
+
+
+def approx_tokens(text):
+    # ~4 characters per subword token: only used to sort and size batches
+    return max(1, len(text) // 4)
+
+
+def available_memory_gb():
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / 1024 ** 3
+    except (ValueError, OSError, AttributeError):
+        # not available on every platform (e.g. macOS)
+        return None
+
+
+def token_budget():
+    memory_gb = available_memory_gb()
+    if memory_gb is None:
+        return DEFAULT_TOKEN_BUDGET
+    return int(min(MAX_TOKEN_BUDGET, max(MIN_TOKEN_BUDGET, memory_gb * TOKENS_PER_GB)))
+
+
+def length_buckets(lengths, budget=None):
+    # item indexes sorted by length and grouped so that batch size x longest item stays under the budget
+    budget = budget or token_budget()
+    buckets = []
+    current = []
+    for index in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        # sorted ascending: the item being added is the longest of its bucket
+        if current and (len(current) + 1) * lengths[index] > budget:
+            buckets.append(current)
+            current = []
+        current.append(index)
+    if current:
+        buckets.append(current)
+    return buckets
+
+
+def bucketed_map(fn, lengths, budget=None):
+    # fn(indexes) returns one output per index of a bucket; outputs come back in the original order
+    outputs = [None] * len(lengths)
+    for bucket in length_buckets(lengths, budget):
+        for index, output in zip(bucket, fn(bucket)):
+            outputs[index] = output
+    return outputs
+
+
+def bucketed_encode(encode, texts, budget=None):
+    # encode(texts, batch_size) -> one vector per text; each bucket is a single padded batch
+    return bucketed_map(
+        lambda bucket: list(encode([texts[i] for i in bucket], len(bucket))),
+        [approx_tokens(text) for text in texts],
+        budget,
+    )
+
+
+def bucketed_pairs(score, references, predictions, budget=None):
+    # score(references, predictions) -> one score per pair; a pair is as long as its longest side
+    return bucketed_map(
+        lambda bucket: list(score([references[i] for i in bucket], [predictions[i] for i in bucket])),
+        [max(approx_tokens(r), approx_tokens(p)) for r, p in zip(references, predictions)],
+        budget,
+    )
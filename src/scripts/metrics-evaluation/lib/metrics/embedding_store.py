@@ -0,0 +1,149 @@
+from .utils import normalize_rows
+from contextlib import contextmanager
+import numpy as np
+import hashlib
+import fcntl
+import json
+import os
+import re
+
+EMBEDDINGS_CACHE_DIR = 'output/cache/embeddings'
+
+STORES = {}
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingStore:
+    # content-addressed vectors of a single model:
+    # - vectors.f32: float32 matrix (rows x dim), appended and read back through a memmap
+    # - index.jsonl: the sha256 of the text stored at each row, one per line
+    # - meta.json:   model name and embedding size
+    # Shards of a metric running in parallel processes share the files: appends happen under a file
+    # lock, and rows are numbered from the lines actually on disk, not from this process' view of them
+
+    def __init__(self, model_name, root=EMBEDDINGS_CACHE_DIR):
+        self.model_name = model_name
+        self.dir = os.path.join(root, re.sub(r'[^A-Za-z0-9._-]+', '_', model_name))
+        self.vectors_path = os.path.join(self.dir, 'vectors.f32')
+        self.index_path = os.path.join(self.dir, 'index.jsonl')
+        self.meta_path = os.path.join(self.dir, 'meta.json')
+        self.index = {}
+        self.rows = 0 # lines of index.jsonl read so far (a hash appended twice keeps its first row)
+        self.index_offset = 0
+        self.dim = None
+        self._vectors = None
+        self._unit_vectors = None
+        self._load()
+
+    @contextmanager
+    def _lock(self):
+        os.makedirs(self.dir, exist_ok=True)
+        with open(os.path.join(self.dir, 'lock'), 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _stored_rows(self):
+        return os.path.getsize(self.vectors_path) // (4 * self.dim) if os.path.exists(self.vectors_path) else 0
+
+    def _read_meta(self):
+        if self.dim is None and os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r') as f:
+                self.dim = json.load(f)['dim']
+
+    def _refresh(self):
+        # index lines appended since the last read, by this process or another one
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, 'rb') as f:
+            f.seek(self.index_offset)
+            data = f.read()
+        self.index_offset += len(data)
+        for line in data.decode('utf-8').splitlines():
+            if line.strip():
+                self.index.setdefault(json.loads(line), self.rows)
+                self.rows += 1
+
+    def _load(self):
+        if not os.path.exists(self.meta_path):
+            return
+        with self._lock():
+            self._read_meta()
+            hashes = []
+            if os.path.exists(self.index_path):
+                with open(self.index_path, 'r') as f:
+                    hashes = [json.loads(line) for line in f if line.strip()]
+            stored_rows = self._stored_rows()
+
+            # a run killed while appending can leave the two files out of sync: keep the common rows only
+            rows = min(len(hashes), stored_rows)
+            if rows != len(hashes) or rows != stored_rows:
+                hashes = hashes[:rows]
+                with open(self.index_path, 'w') as f:
+                    f.writelines(json.dumps(h) + '\n' for h in hashes)
+                with open(self.vectors_path, 'ab') as f:
+                    f.truncate(rows * 4 * self.dim)
+            self._refresh()
+
+    def _append(self, hashes, vectors):
+        with self._lock():
+            self._read_meta()
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with open(self.meta_path, 'w') as f:
+                    json.dump({'model': self.model_name, 'dim': self.dim}, f)
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding size changed for {self.model_name}: {vectors.shape[1]} != {self.dim}")
+
+            # other processes may have stored rows (even these texts) since this store was loaded
+            self._refresh()
+            new = [position for position, h in enumerate(hashes) if h not in self.index]
+            if self._stored_rows() > self.rows:
+                # vectors of a killed append that never reached the index
+                with open(self.vectors_path, 'ab') as f:
+                    f.truncate(self.rows * 4 * self.dim)
+
+            # vectors first, so that an indexed row always has its vector on disk
+            with open(self.vectors_path, 'ab') as f:
+                f.write(np.ascontiguousarray(vectors[new], dtype=np.float32).tobytes())
+            with open(self.index_path, 'ab') as f:
+                f.write(''.join(json.dumps(hashes[position]) + '\n' for position in new).encode('utf-8'))
+            self._refresh()
+
+        self._vectors = None
+        self._unit_vectors = None
+
+    def _matrix(self):
+        if self._vectors is None:
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(self.rows, self.dim))
+        return self._vectors
+
+    def _unit_matrix(self):
+        # unit-length copy of the stored vectors, normalized once and reused by every lookup
+        if self._unit_vectors is None:
+            self._unit_vectors = normalize_rows(self._matrix())
+        return self._unit_vectors
+
+    def encode(self, texts, encode, normalized=False):
+        # returns one row per text, calling `encode` only on texts never embedded before.
+        # normalized=True returns unit-length rows (for paired_cosine_similarity(..., normalized=True))
+        keys = [text_hash(text) for text in texts]
+        missing = list(dict.fromkeys(text for text, key in zip(texts, keys) if key not in self.index))
+        if missing:
+            vectors = np.asarray(encode(missing), dtype=np.float32)
+            self._append([text_hash(text) for text in missing], vectors)
+        if not keys:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        rows = [self.index[key] for key in keys]
+        return self._unit_matrix()[rows] if normalized else np.asarray(self._matrix()[rows])
+
+
+def get_embedding_store(model_name):
+    if model_name not in STORES:
+        STORES[model_name] = EmbeddingStore(model_name)
+    return STORES[model_name]
@@ -1,17 +1,36 @@
-# from .test_specific import METRICS as TEST_SPECIFIC_METRICS
-from .text_overlapping import METRICS as TEXT_OVERLAPPING_METRICS
-from .learned_models import METRIC as LEARNED_MODELS_METRICS
-from .word_embeddings import METRICS as WORD_EMBEDDINGS_METRICS
-# from .answer_embeddings import METRICS as ANSWER_EMBEDDINGS_METRICS
-from .llm_as_a_judge import METRICS as LLM_AS_A_JUDGE_METRICS
+from importlib import import_module
 
-METRICS = {
-    # **LLM_AS_A_JUDGE_METRICS,
-    # **TEST_SPECIFIC_METRICS, 
-    **TEXT_OVERLAPPING_METRICS,
-    **LEARNED_MODELS_METRICS, 
-    **WORD_EMBEDDINGS_METRICS,
-    # **ANSWER_EMBEDDINGS_METRICS,
+# metric name -> module declaring it (in its METRICS dict).
+# Modules are imported only when one of their metrics is selected, and they
+# load their models on first use, so a run only pays for the metrics it needs.
+# keyword_based (test_specific) and the llm_judge_custom_* metrics (llm_as_a_judge)
+# need per-test keywords / the query and are not listed here.
+REGISTRY = {
+    'rouge_recall': 'text_overlapping',
+    'rouge_precision': 'text_overlapping',
+    'meteor': 'text_overlapping',
+    'bleurt': 'learned_models',
+    'bertscore': 'word_embeddings',
+    'mistral-embed': 'answer_embeddings',
+    'paraphrase_miniLM': 'answer_embeddings',
+    'embedding_gemma': 'answer_embeddings',
+    'mmbertscore': 'answer_embeddings',
+    'exact_match': 'test_specific',
 }
 
-print("Loaded metrics:", list(METRICS.keys()))
\ No newline at end of file
+DEFAULT_METRICS = [
+    'rouge_recall',
+    'rouge_precision',
+    'meteor',
+    'bleurt',
+    'bertscore',
+]
+
+def load_metric(metric_name):
+    if metric_name not in REGISTRY:
+        raise ValueError(f"Unknown metric: {metric_name}. Available metrics: {', '.join(REGISTRY)}")
+    module = import_module(f'.{REGISTRY[metric_name]}', __package__)
+    return module.METRICS[metric_name]
+
+def load_metrics(metric_names=None):
+    return {metric_name: load_metric(metric_name) for metric_name in (metric_names or DEFAULT_METRICS)}
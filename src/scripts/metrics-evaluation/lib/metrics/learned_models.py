@@ -19,14 +19,15 @@ from .utils import HUGGINGFACE
     
 #     return {"unieval": results[0]['overall']}
 
-METRIC = {
+METRICS = {
     # "comet" : {
     #     "function": HUGGINGFACE,
     #     "result_key": 'scores'
     # },
     "bleurt": {
         "function": HUGGINGFACE,
-        "result_key": 'scores'       
+        "result_key": 'scores',
+        "memory_mb": 2000
     }, 
     # "unieval" : {
     #     "function" : unieval,
@@ -1,11 +1,26 @@
 from pydantic import BaseModel
-from time import sleep
-from mistralai import Mistral
+from .utils import lazy
+from ..resilience import RequestScheduler
+from ..response_cache import ResponseCache, cache_key
+from ..usage import UsageTracker, usage_from_response
+import time
 import os
 from dotenv import load_dotenv
 load_dotenv('.env')
 
-mistral_client = Mistral(api_key=os.getenv("MISTRAL_API_KEY"))
+@lazy
+def mistral_client():
+    from mistralai import Mistral
+    return Mistral(api_key=os.getenv("MISTRAL_API_KEY"))
+
+# shared by every judge call of the process: retries, backoff and circuit breaker state
+JUDGE_SCHEDULER = RequestScheduler()
+# tokens, latency and cost of every judge call of the process, per label (prompt version) and model
+JUDGE_USAGE = UsageTracker()
+
+@lazy
+def judge_cache():
+    return ResponseCache()
 
 def evaluation_prompt(expected_answer=None, given_answer=None, query=None):
     
@@ -65,7 +80,7 @@ GIVEN ANSWER:
 """.strip()
     return prompt
 
-def llm_judge_custom(references, predictions, query, llm, prompt_funct=evaluation_prompt):
+def llm_judge_custom(references, predictions, query, llm, prompt_funct=evaluation_prompt, use_cache=True, label='llm_judge_custom'):
     
     scores = []
     
@@ -78,25 +93,38 @@ def llm_judge_custom(references, predictions, query, llm, prompt_funct=evaluatio
         print('Evaluating...')
         prompt = prompt_funct(expected_answer, given_answer, query)
         
-        def get_response():
-            response = mistral_client.chat.parse(
-                temperature=0, 
-                model=llm,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ],
-                response_format=EvalResult
-            )
-
-            return response
-        
-        try:
-            response = get_response()
-        except Exception:
-            sleep(10)
-            response = get_response()
+        key = cache_key('mistral', llm, 0, EvalResult, prompt)
+        evaluation = judge_cache().get(key, EvalResult) if use_cache else None
+
+        if evaluation is None:
+            attempts = 0
+
+            def get_response():
+                nonlocal attempts
+                attempts += 1
+                response = mistral_client().chat.parse(
+                    temperature=0, 
+                    model=llm,
+                    messages=[
+                        {"role": "user", "content": prompt}
+                    ],
+                    response_format=EvalResult
+                )
+
+                return response
+
+            start = time.monotonic()
+            try:
+                response = JUDGE_SCHEDULER.call(get_response)
+            except Exception:
+                JUDGE_USAGE.record(label, llm, None, time.monotonic() - start, attempts, ok=False)
+                raise
+            latency = time.monotonic() - start
+            JUDGE_USAGE.record(label, llm, usage_from_response(response), latency, attempts)
+            evaluation = response.choices[0].message.parsed
+            if use_cache:
+                judge_cache().put(key, 'mistral', llm, prompt, evaluation, latency)
 
-        evaluation = response.choices[0].message.parsed
         scores.append(evaluation.score)
 
     return {"score": sum(scores) / len(scores)}
@@ -0,0 +1,98 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .runner import score_pairs
+
+# approximate resident memory of a loaded metric, when its spec does not declare "memory_mb"
+DEFAULT_MEMORY_MB = 300
+# below this many pairs a shard is not worth loading the model in one more process
+MIN_SHARD_SIZE = 64
+
+
+def plan_shards(jobs, workers, memory_budget_mb=None):
+    # jobs: list of (metric_name, n_pairs, memory_mb, shardable).
+    # Returns (worker, job index, start, end) shards. A model counts once against the budget of each
+    # worker holding it: every job first gets one worker, then shardable jobs are replicated only
+    # where the budget still has room, so big models are not loaded on every worker.
+    used = [0] * workers
+    resident = [set() for _ in range(workers)]
+    load = [0] * workers
+    placement = [[] for _ in jobs]
+
+    def fits(worker, metric_name, memory_mb):
+        return metric_name in resident[worker] or memory_budget_mb is None or used[worker] + memory_mb <= memory_budget_mb
+
+    def place(worker, job_index):
+        metric_name, n_pairs, memory_mb, _ = jobs[job_index]
+        if metric_name not in resident[worker]:
+            resident[worker].add(metric_name)
+            used[worker] += memory_mb
+        load[worker] += n_pairs
+        placement[job_index].append(worker)
+
+    order = sorted(range(len(jobs)), key=lambda j: (-jobs[j][2], j))
+    for job_index in order:
+        metric_name, _, memory_mb, _ = jobs[job_index]
+        candidates = [w for w in range(workers) if fits(w, metric_name, memory_mb)]
+        if not candidates:
+            print(f"Warning: {metric_name} ({memory_mb} MB) does not fit the per-worker memory budget, running it on the least loaded worker")
+            candidates = [min(range(workers), key=lambda w: used[w])]
+        place(min(candidates, key=lambda w: (metric_name not in resident[w], load[w])), job_index)
+
+    for job_index in order:
+        metric_name, n_pairs, memory_mb, shardable = jobs[job_index]
+        wanted = min(workers, max(1, n_pairs // MIN_SHARD_SIZE)) if shardable else 1
+        while len(placement[job_index]) < wanted:
+            candidates = [w for w in range(workers) if w not in placement[job_index] and fits(w, metric_name, memory_mb)]
+            if not candidates:
+                break
+            place(min(candidates, key=lambda w: (metric_name not in resident[w], load[w])), job_index)
+
+    shards = []
+    for job_index, job_workers in enumerate(placement):
+        n_pairs = jobs[job_index][1]
+        bounds = [n_pairs * i // len(job_workers) for i in range(len(job_workers) + 1)]
+        for worker, start, end in zip(job_workers, bounds, bounds[1:]):
+            if end > start:
+                shards.append((worker, job_index, start, end))
+    return shards
+
+
+class MetricScheduler:
+    # spreads metric jobs over `workers` single-process pools: each worker keeps the models it
+    # loaded (lazy singletons) for all of its shards, and results are merged by position
+
+    def __init__(self, workers, memory_budget_mb=None):
+        self.workers = workers
+        self.memory_budget_mb = memory_budget_mb
+
+    def run(self, jobs, on_shard):
+        # jobs: list of dicts with metric_name, metric (spec), references, predictions.
+        # on_shard(job index, start, scores) is called in completion order, scores land at job positions
+        plan = plan_shards(
+            [
+                (
+                    job['metric_name'],
+                    len(job['references']),
+                    job['metric'].get('memory_mb', DEFAULT_MEMORY_MB),
+                    job['metric'].get('shardable', True),
+                )
+                for job in jobs
+            ],
+            self.workers,
+            self.memory_budget_mb,
+        )
+
+        executors = [ProcessPoolExecutor(max_workers=1) for _ in range(self.workers)]
+        try:
+            futures = {}
+            for worker, job_index, start, end in plan:
+                job = jobs[job_index]
+                future = executors[worker].submit(
+                    score_pairs, job['metric_name'], job['references'][start:end], job['predictions'][start:end]
+                )
+                futures[future] = (job_index, start)
+            for future in as_completed(futures):
+                job_index, start = futures[future]
+                on_shard(job_index, start, future.result())
+        finally:
+            for executor in executors:
+                executor.shutdown()
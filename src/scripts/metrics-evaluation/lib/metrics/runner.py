@@ -0,0 +1,49 @@
+from .index import load_metric
+from .utils import HUGGINGFACE
+from .batching import bucketed_pairs
+from functools import cache
+
+@cache
+def load_evaluator(metric_name):
+    # one loaded evaluator per metric and process (BLEURT loads its checkpoint here)
+    import evaluate
+    return evaluate.load(metric_name)
+
+def score_pairs(metric_name, references, predictions, metric=None, on_score=None):
+    # one score per (reference, prediction) pair, in order.
+    # on_score(index, score) is called as scores become available (per item for non-batched metrics)
+    metric = metric or load_metric(metric_name)
+    result_key = metric['result_key']
+
+    if metric['function'] == HUGGINGFACE:
+        print(f"Metric {metric_name} is a HuggingFace metric, BATCH PROCESSING IT...")
+        evaluator = load_evaluator(metric_name)
+        # length-bucketed compute calls: short answers are not padded to the longest one
+        scores = bucketed_pairs(
+            lambda refs, preds: evaluator.compute(
+                references=refs, 
+                predictions=preds,
+                **({"lang": "it"} if metric_name == 'bertscore' else {}),
+                **({"sources": refs} if metric_name == 'comet' else {})
+            )[result_key],
+            references,
+            predictions
+        )
+    elif metric.get('batched'):
+        print(f"Metric {metric_name} is a batched custom function, BATCH PROCESSING IT...")
+        results = metric['function'](references=references, predictions=predictions)
+        scores = list(results[result_key])
+    else:
+        print(f"Metric {metric_name} is a custom function, PROCESSING ITEM BY ITEM...")
+        scores = []
+        for index, (reference, prediction) in enumerate(zip(references, predictions)):
+            result = metric['function'](references=[reference], predictions=[prediction])
+            scores.append(result[result_key])
+            if on_score is not None:
+                on_score(index, scores[-1])
+        return scores
+
+    if on_score is not None:
+        for index, score in enumerate(scores):
+            on_score(index, score)
+    return scores
@@ -1,5 +1,3 @@
-from .utils import HUGGINGFACE
-
 def test_specific_score(predictions, references, keywords_list):
     scores = []
     for pred, keywords in zip(predictions, keywords_list):
@@ -14,13 +12,18 @@ def test_specific_score(predictions, references, keywords_list):
 
     return {"keyword_based": scores}
 
+def exact_match(references, predictions):
+    # one score per pair (evaluate's exact_match only returns the rate over the whole list)
+    return {"exact_match": [float(pred == ref) for ref, pred in zip(references, predictions)]}
+
 METRICS = {
     'keyword_based': {
         "function": test_specific_score,
         "result_key": 'keyword_based'
     },
     'exact_match': {
-        "function": HUGGINGFACE,
-        "result_key": 'exact_match'
+        "function": exact_match,
+        "result_key": 'exact_match',
+        "batched": True
     }
 }
\ No newline at end of file
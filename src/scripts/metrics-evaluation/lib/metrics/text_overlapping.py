@@ -1,39 +1,122 @@
-import evaluate    
-from rouge_score import rouge_scorer
-meteor_metric = evaluate.load('meteor') 
+from collections import Counter, namedtuple
+from functools import lru_cache
+from .utils import lazy
 
-def rouge(references, predictions):
-    scorer = rouge_scorer.RougeScorer(['rouge1'], use_stemmer=True)
-    scores = scorer.score(references, predictions)
-    return scores
+# same fields and formulas as rouge_score.scoring.Score / rouge_scorer
+Score = namedtuple('Score', ['precision', 'recall', 'fmeasure'])
+
+# nltk meteor_score defaults, as used by evaluate's meteor
+METEOR_ALPHA = 0.9
+METEOR_BETA = 3
+METEOR_GAMMA = 0.5
+# texts kept tokenized at once: enough for the references of a run, bounded for long-lived processes
+TOKEN_CACHE_SIZE = 4096
+
+@lazy
+def meteor_metric():
+    # loading it also downloads the nltk resources (wordnet, punkt, omw) meteor needs
+    import evaluate
+    return evaluate.load('meteor')
+
+@lazy
+def rouge_tokenizer():
+    from rouge_score import tokenizers
+    return tokenizers.DefaultTokenizer(use_stemmer=True)
+
+# per-text caches: a reference is tokenized and stemmed once for all its candidates
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def rouge_tokens(text):
+    return tuple(rouge_tokenizer().tokenize(text))
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def ngram_counts(text, n):
+    tokens = rouge_tokens(text)
+    return Counter(tokens[i:i + n] for i in range(len(tokens) - n + 1))
+
+def fmeasure(precision, recall):
+    return 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+
+def ngram_score(reference, prediction, n):
+    target, predicted = ngram_counts(reference, n), ngram_counts(prediction, n)
+    overlap = sum((target & predicted).values())
+    precision = overlap / max(sum(predicted.values()), 1)
+    recall = overlap / max(sum(target.values()), 1)
+    return Score(precision, recall, fmeasure(precision, recall))
+
+def lcs_length(a, b):
+    previous = [0] * (len(b) + 1)
+    for x in a:
+        current = [0]
+        for j, y in enumerate(b):
+            current.append(previous[j] + 1 if x == y else max(previous[j + 1], current[j]))
+        previous = current
+    return previous[-1]
+
+def lcs_score(reference, prediction):
+    target, predicted = rouge_tokens(reference), rouge_tokens(prediction)
+    if not target or not predicted:
+        return Score(0.0, 0.0, 0.0)
+    lcs = lcs_length(target, predicted)
+    precision, recall = lcs / len(predicted), lcs / len(target)
+    return Score(precision, recall, fmeasure(precision, recall))
+
+def rouge_score(reference, prediction, rouge_type):
+    # precision, recall and F of a pair in one pass (not memoized: pairs are rarely repeated, texts are)
+    if rouge_type == 'rougeL':
+        return lcs_score(reference, prediction)
+    return ngram_score(reference, prediction, int(rouge_type[len('rouge'):]))
+
+def rouge(references, predictions, rouge_type='rouge1'):
+    # one Score per (reference, prediction) pair
+    return [rouge_score(r, p, rouge_type) for r, p in zip(references, predictions)]
+
+def rouge1(references, predictions):
+    return rouge(references, predictions, 'rouge1')
+
+def rouge2(references, predictions):
+    return rouge(references, predictions, 'rouge2')
+
+def rougeL(references, predictions):
+    return rouge(references, predictions, 'rougeL')
 
 def rouge_recall(references, predictions):
-    if len(references) != 1 or len(predictions) != 1:
-        raise ValueError("rouge_recall metric only supports single reference and single prediction.")
-    scores = rouge(references[0], predictions[0])
-    return {'rouge_recall': scores['rouge1'].recall}
+    return {'rouge_recall': [score.recall for score in rouge1(references, predictions)]}
 
 def rouge_precision(references, predictions):
-    if len(references) != 1 or len(predictions) != 1:
-        raise ValueError("rouge_precision metric only supports single reference and single prediction.")
-    scores = rouge(references[0], predictions[0])
-    return {'rouge_precision': scores['rouge1'].precision}
+    return {'rouge_precision': [score.precision for score in rouge1(references, predictions)]}
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def meteor_tokens(text):
+    from nltk import word_tokenize
+    return tuple(word_tokenize(text))
 
 def meteor(references, predictions):
-    results = meteor_metric.compute(predictions=predictions, references=references)
-    return {'meteor': results['meteor']}
+    # evaluate's meteor only returns the corpus mean, so the per-pair scores are computed here
+    # with the same nltk call and parameters it uses, on cached tokenizations
+    from nltk.translate.meteor_score import single_meteor_score
+    meteor_metric()
+    return {'meteor': [
+        single_meteor_score(
+            meteor_tokens(r), meteor_tokens(p), alpha=METEOR_ALPHA, beta=METEOR_BETA, gamma=METEOR_GAMMA
+        )
+        for r, p in zip(references, predictions)
+    ]}
 
 METRICS = {
     'rouge_recall': {
         "function": rouge_recall,
-        "result_key": 'rouge_recall'
+        "result_key": 'rouge_recall',
+        "batched": True
     },
     'rouge_precision': {
         "function": rouge_precision,
-        "result_key": 'rouge_precision'
+        "result_key": 'rouge_precision',
+        "batched": True
     },
     'meteor': {
         "function": meteor,
-        "result_key": 'meteor'
+        "result_key": 'meteor',
+        "batched": True
     },
-}
\ No newline at end of file
+}
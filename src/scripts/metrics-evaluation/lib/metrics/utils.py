@@ -1,9 +1,29 @@
 HUGGINGFACE = 'huggingface' # placeholder per le metriche di HuggingFace
 
-from sklearn.metrics.pairwise import cosine_similarity
+from functools import cache
+import numpy as np
 
-def normalized_01_cosine_similarity(a, b):   
-    cs = cosine_similarity(a, b).tolist()[0][0]
-    # renormalize in 0,1
-    cs = (cs + 1) / 2
-    return cs
\ No newline at end of file
+# lazy singletons: `@cache` on a zero-argument factory builds the object on first call
+lazy = cache
+
+def normalize_rows(x):
+    # float32 unit rows; all-zero rows stay zero (similarity 0, like sklearn's normalize)
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.where(norms == 0, 1, norms)
+
+def paired_cosine_similarity(a, b, normalized=False):
+    # (N, d) x (N, d) -> N row-wise similarities, without building the N x N matrix.
+    # normalized=True skips the normalization of vectors that are already unit length (e.g. cached ones)
+    if not normalized:
+        a, b = normalize_rows(a), normalize_rows(b)
+    return np.einsum('ij,ij->i', a, b)
+
+def normalized_01_cosine_similarity(a, b, normalized=False):
+    # single pair, renormalized in 0,1
+    cs = paired_cosine_similarity(np.atleast_2d(a), np.atleast_2d(b), normalized)[0]
+    return float((cs + 1) / 2)
+
+def normalized_01_paired_cosine_similarity(a, b, normalized=False):
+    # one similarity per row pair (a[i], b[i]), renormalized in 0,1
+    return ((paired_cosine_similarity(a, b, normalized) + 1) / 2).tolist()
@@ -1,17 +1,116 @@
-from bert_score import BERTScorer
+from .batching import bucketed_pairs, length_buckets, approx_tokens
+from .utils import lazy
+from collections import defaultdict
+import sys
+
+BERTSCORE_MODEL = 'bert-base-multilingual-cased'
+# idf weighting computed once from every FullRef/KeyRef of the dataset (changes the scores, off by default)
+BERTSCORE_IDF = False
+
+class CachedBERTScorer:
+    # long-lived BERTScorer that keeps the token embeddings of the references it has encoded:
+    # a reference shared by all the candidates of a group goes through the model only once
+
+    def __init__(self, idf_sents=None):
+        from bert_score import BERTScorer
+        self.scorer = BERTScorer(
+            lang='it',
+            device='cpu',
+            model_type=BERTSCORE_MODEL,
+            idf=idf_sents is not None,
+            idf_sents=idf_sents
+        )
+        if idf_sents is None:
+            # BERTScorer leaves _idf_dict to None without idf: same default weights as BERTScorer.score,
+            # every token 1 except [SEP] and [CLS]
+            self.idf_dict = defaultdict(lambda: 1.0)
+            self.idf_dict[self.scorer._tokenizer.sep_token_id] = 0
+            self.idf_dict[self.scorer._tokenizer.cls_token_id] = 0
+        else:
+            self.idf_dict = self.scorer._idf_dict
+        self.stats = {} # sentence -> (token embeddings, token idf weights)
+        self.references = set()
+
+    def _embed(self, sentences):
+        from bert_score.utils import get_bert_embedding
+        missing = [s for s in dict.fromkeys(sentences) if s not in self.stats]
+        for bucket in length_buckets([approx_tokens(s) for s in missing]):
+            batch = [missing[i] for i in bucket]
+            embs, masks, idf = get_bert_embedding(
+                batch, self.scorer._model, self.scorer._tokenizer, self.idf_dict, device=self.scorer.device
+            )
+            for i, sentence in enumerate(batch):
+                length = int(masks[i].sum().item())
+                self.stats[sentence] = (embs[i, :length].cpu(), idf[i, :length].cpu())
+
+    def _pad(self, sentences):
+        # same padding as bert_score.score, from the cached per-sentence stats
+        import torch
+        from torch.nn.utils.rnn import pad_sequence
+        embs, idfs = zip(*(self.stats[s] for s in sentences))
+        lengths = torch.tensor([e.size(0) for e in embs])
+        mask = torch.arange(int(lengths.max())).expand(len(lengths), -1) < lengths.unsqueeze(1)
+        return pad_sequence(embs, batch_first=True, padding_value=2.0), mask, pad_sequence(idfs, batch_first=True)
+
+    def f1(self, references, predictions):
+        import torch
+        from bert_score.utils import greedy_cos_idf
+        self.references.update(references)
+        self._embed(references + predictions)
+
+        def score(refs, preds):
+            with torch.no_grad():
+                _, _, f1 = greedy_cos_idf(*self._pad(refs), *self._pad(preds))
+            return f1.tolist()
+
+        try:
+            return bucketed_pairs(score, references, predictions)
+        finally:
+            # predictions are rarely scored twice: their embeddings are dropped so that long-lived (worker)
+            # processes only keep the references, bounded by the dataset
+            for sentence in set(predictions) - self.references:
+                self.stats.pop(sentence, None)
+
+def reference_corpus():
+    from ..data_loader import load_metrics_tests
+    tests = load_metrics_tests()
+    return list(dict.fromkeys(ref for test in tests.values() for ref in (test['FullRef'], test['KeyRef']) if ref))
+
+@lazy
+def bertscorer():
+    # built on first use; the idf weights come from the whole reference corpus, not from the
+    # current call, so that every shard of a parallel run uses the same weights
+    return CachedBERTScorer(idf_sents=reference_corpus() if BERTSCORE_IDF else None)
 
 def bertscore(references, predictions):
-    scorer = BERTScorer(
-        lang='it',
-        device='cpu',
-        model_type='bert-base-multilingual-cased'
-    )
-    _, _, f1 = scorer.score(references, predictions)
-    return { 'f1':f1.tolist()[0]  } # custom score are processed sequentially
+    return { 'f1': bertscorer().f1(references, predictions) } # one f1 per (reference, prediction) pair
 
 METRICS = {
     'bertscore': {
         "function": bertscore,
-        "result_key": 'f1'
+        "result_key": 'f1',
+        "batched": True,
+        "memory_mb": 1200
     },
-}
\ No newline at end of file
+}
+
+if __name__ == "__main__":
+    # python -m lib.metrics.word_embeddings: the cached scorer must give the same f1 as BERTScorer.score
+    references = [
+        "Il paracetamolo si assume ogni 8 ore.",
+        "Il paracetamolo si assume ogni 8 ore.",
+        "La pressione va misurata al mattino, a riposo.",
+    ]
+    predictions = [
+        "Ogni otto ore.",
+        "Si prende quando serve, senza limiti.",
+        "Misura la pressione la mattina dopo qualche minuto di riposo.",
+    ]
+    cached = bertscore(references, predictions)['f1']
+    expected = bertscorer().scorer.score(predictions, references)[2].tolist()
+    print(f"cached:   {cached}\nexpected: {expected}")
+    if max(abs(a - b) for a, b in zip(cached, expected)) > 1e-4:
+        sys.exit("bertscore: cached scorer differs from BERTScorer.score")
+    if set(bertscorer().stats) != set(references):
+        sys.exit("bertscore: the cache keeps sentences other than the references")
+    print("bertscore: OK")
@@ -0,0 +1,188 @@
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import asyncio
+import json
+import random
+import time
+
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+# malformed structured outputs are worth asking again
+RETRYABLE_ERRORS = {'ValidationError', 'JSONDecodeError'}
+
+
+def http_response(exc):
+    # openai errors expose `response`, mistralai errors `raw_response`
+    response = getattr(exc, 'response', None)
+    return response if response is not None else getattr(exc, 'raw_response', None)
+
+
+def status_code(exc):
+    status = getattr(exc, 'status_code', None)
+    if status is None:
+        status = getattr(http_response(exc), 'status_code', None)
+    return status
+
+
+def is_retryable(exc):
+    status = status_code(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError, ConnectionError, json.JSONDecodeError)):
+        return True
+    name = type(exc).__name__
+    return name in RETRYABLE_ERRORS or 'Timeout' in name or 'Connection' in name
+
+
+def is_provider_error(exc):
+    # errors coming from the provider or the network; anything else is a bug and must not be swallowed
+    return status_code(exc) is not None or http_response(exc) is not None or is_retryable(exc)
+
+
+def retry_after(exc):
+    # seconds asked by the server through the Retry-After header, if any
+    headers = getattr(http_response(exc), 'headers', None)
+    if not headers:
+        return None
+    value = headers.get('retry-after')
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    def __init__(self, max_retries=5, base_delay=1.0, max_delay=60.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt, exc):
+        # Retry-After wins when present, otherwise exponential backoff with full jitter
+        requested = retry_after(exc)
+        if requested is not None:
+            return requested
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class CircuitBreaker:
+    # opens after `failure_threshold` consecutive failures; after `reset_timeout`
+    # seconds a single probe call is let through and closes it again on success
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def wait_time(self):
+        if self.opened_at is None:
+            return 0.0
+        remaining = self.opened_at + self.reset_timeout - time.monotonic()
+        if remaining > 0 or self.probing:
+            return max(remaining, 0.1)
+        self.probing = True
+        return 0.0
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def release(self):
+        # a call that tells nothing about the service health: a probe in flight may be retried by the next call
+        self.probing = False
+
+    def failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self.probing = False
+
+
+class CallStats:
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.attempts = []
+        self.latencies = []
+
+    def record(self, latency, attempts, ok):
+        self.calls += 1
+        self.failures += 0 if ok else 1
+        self.attempts.append(attempts)
+        self.latencies.append(latency)
+
+    def summary(self):
+        if not self.calls:
+            return "No calls"
+        retries = sum(self.attempts) - self.calls
+        mean_latency = sum(self.latencies) / self.calls
+        return (
+            f"Calls: {self.calls} | Failed: {self.failures} | Retries: {retries} | "
+            f"Max attempts: {max(self.attempts)} | Mean latency: {mean_latency:.2f}s | "
+            f"Max latency: {max(self.latencies):.2f}s"
+        )
+
+
+class RequestScheduler:
+    # shared retry layer for provider calls, usable from sync code (call) and asyncio (acall)
+
+    def __init__(self, policy=None, breaker=None):
+        self.policy = policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.stats = CallStats()
+
+    def _failed(self, attempt, exc):
+        # returns the delay before the next attempt, None when the error must propagate
+        if not is_retryable(exc):
+            # the error is about this request, not the service health: neither a success nor a failure
+            self.breaker.release()
+            return None
+        self.breaker.failure()
+        if attempt == self.policy.max_retries:
+            return None
+        return self.policy.delay(attempt, exc)
+
+    def call(self, fn):
+        start = time.monotonic()
+        for attempt in range(self.policy.max_retries + 1):
+            while (wait := self.breaker.wait_time()) > 0:
+                time.sleep(wait)
+            try:
+                result = fn()
+            except Exception as exc:
+                delay = self._failed(attempt, exc)
+                if delay is None:
+                    self.stats.record(time.monotonic() - start, attempt + 1, ok=False)
+                    raise
+                print(f"Request failed ({type(exc).__name__}: {exc}), retrying in {delay:.1f}s...")
+                time.sleep(delay)
+                continue
+            self.breaker.success()
+            self.stats.record(time.monotonic() - start, attempt + 1, ok=True)
+            return result
+
+    async def acall(self, fn):
+        start = time.monotonic()
+        for attempt in range(self.policy.max_retries + 1):
+            while (wait := self.breaker.wait_time()) > 0:
+                await asyncio.sleep(wait)
+            try:
+                result = await fn()
+            except Exception as exc:
+                delay = self._failed(attempt, exc)
+                if delay is None:
+                    self.stats.record(time.monotonic() - start, attempt + 1, ok=False)
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.success()
+            self.stats.record(time.monotonic() - start, attempt + 1, ok=True)
+            return result
@@ -0,0 +1,68 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+RESPONSE_CACHE_PATH = 'output/cache/llm-responses.sqlite'
+
+
+def sha256(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def cache_key(provider, model, temperature, response_format, prompt):
+    schema = json.dumps(response_format.model_json_schema(), sort_keys=True)
+    return sha256(json.dumps([provider, model, temperature, schema, sha256(prompt)]))
+
+
+class ResponseCache:
+    # parsed judge responses keyed by (provider, model, temperature, response schema, prompt hash)
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, enabled=True):
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.connection = None
+        if not enabled:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                provider TEXT,
+                model TEXT,
+                prompt_sha256 TEXT,
+                parsed TEXT,
+                explanation TEXT,
+                latency REAL,
+                created_at REAL
+            )
+        """)
+
+    def get(self, key, response_format):
+        if not self.enabled:
+            return None
+        row = self.connection.execute('SELECT parsed FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return response_format.model_validate_json(row[0])
+
+    def put(self, key, provider, model, prompt, parsed, latency):
+        if not self.enabled or parsed is None:
+            return
+        self.connection.execute(
+            'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (key, provider, model, sha256(prompt), parsed.model_dump_json(), getattr(parsed, 'explanation', None), latency, time.time())
+        )
+
+    def summary(self):
+        if not self.enabled:
+            return "Response cache disabled"
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return f"Response cache hits: {self.hits}/{total} ({rate:.1%})"
@@ -0,0 +1,113 @@
+import os
+
+RESULTS_STORE_DIR = 'output/evaluations/metrics/store'
+PARTITIONS = ['metric', 'model', 'provider', 'version']
+REF_SUFFIXES = {'full': 'fullref', 'key': 'keyref'}
+
+
+def _pyarrow():
+    # optional dependency: only needed for --parquet and query_results.py
+    try:
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+    except ImportError as exc:
+        raise ImportError("The Parquet results store requires pyarrow (pip install pyarrow)") from exc
+    return pa, ds
+
+
+def schema():
+    pa, _ = _pyarrow()
+    return pa.schema([
+        ('group', pa.string()),
+        ('test', pa.string()),
+        ('main_category', pa.int64()),
+        ('sub_category', pa.int64()),
+        ('candidate', pa.string()),
+        ('expected_continuous', pa.float64()),
+        ('expected_binary', pa.int64()),
+        ('trial', pa.int64()),
+        ('ref_mode', pa.string()),
+        ('result_continuous_raw', pa.float64()),
+        ('result_continuous', pa.float64()),
+        ('result_binary', pa.int64()),
+        ('threshold', pa.float64()),
+    ] + [(column, pa.string()) for column in PARTITIONS])
+
+
+def partitioning():
+    pa, ds = _pyarrow()
+    return ds.partitioning(pa.schema([(column, pa.string()) for column in PARTITIONS]), flavor='hive')
+
+
+def long_rows(row, trial=None):
+    # one stored row per (item, ref mode): metrics_assessment rows carry both the fullref and keyref scores,
+    # llm / prompt rows a single result
+    base = {
+        'group': row.get('group'),
+        'test': row.get('test'),
+        'main_category': row.get('main_category'),
+        'sub_category': row.get('sub_category'),
+        'candidate': row.get('candidate'),
+        'expected_continuous': row.get('expected_continuous'),
+        'expected_binary': row.get('expected_binary'),
+        'trial': trial,
+    }
+    if 'result_continuous_fullref' in row:
+        for ref_mode, suffix in REF_SUFFIXES.items():
+            yield {
+                **base,
+                'ref_mode': ref_mode,
+                'result_continuous_raw': row[f'result_continuous_{suffix}_raw'],
+                'result_continuous': row[f'result_continuous_{suffix}'],
+                'result_binary': row[f'result_binary_{suffix}'],
+                'threshold': row[f'threshold_{ref_mode}'],
+            }
+    else:
+        yield {
+            **base,
+            'ref_mode': None,
+            'result_continuous_raw': row['result_continuous'],
+            'result_continuous': row['result_continuous'],
+            'result_binary': row['result_binary'],
+            'threshold': row['threshold'],
+        }
+
+
+def write_results(metrics_results, model, provider, version, root=RESULTS_STORE_DIR):
+    # metrics_results: {metric: [row, ...]} or, for prompt_assessment, {metric: [[trial rows], ...]}.
+    # Rewrites the metric/model/provider/version partitions being written, leaves the other runs alone
+    pa, ds = _pyarrow()
+    records = []
+    for metric, results in metrics_results.items():
+        trials = results if results and isinstance(results[0], list) else [results]
+        for trial, rows in enumerate(trials):
+            for row in rows:
+                for record in long_rows(row, trial if trials is results else None):
+                    record.update(metric=metric, model=model, provider=provider, version=version)
+                    records.append(record)
+    if not records:
+        return
+    os.makedirs(root, exist_ok=True)
+    ds.write_dataset(
+        pa.Table.from_pylist(records, schema=schema()),
+        root,
+        format='parquet',
+        partitioning=partitioning(),
+        existing_data_behavior='delete_matching',
+        basename_template='part-{i}.parquet',
+    )
+
+
+def open_results(root=RESULTS_STORE_DIR):
+    _, ds = _pyarrow()
+    return ds.dataset(root, format='parquet', schema=schema(), partitioning=partitioning())
+
+
+def where(conditions, dataset):
+    # {"metric": "bleurt", "version": "v2"} -> dataset filter expression (pushed down to partitions and row groups)
+    pa, ds = _pyarrow()
+    expression = None
+    for column, value in conditions.items():
+        condition = ds.field(column) == pa.scalar(value).cast(dataset.schema.field(column).type)
+        expression = condition if expression is None else expression & condition
+    return expression
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import sys
+
+# long texts repeated by every metric / trial: the rows only keep their id,
+# the text itself is written once to the dictionary file
+TEXT_FIELDS = ('test', 'candidate')
+
+
+def text_id(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+def dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=float)
+
+
+def stream_paths(path):
+    # results.jsonl -> (results.jsonl, results.texts.jsonl)
+    base = path[:-len('.jsonl')] if path.endswith('.jsonl') else path
+    return base + '.jsonl', base + '.texts.jsonl'
+
+
+class ResultsWriter:
+    # streaming alternative to the final results.json dump:
+    # - <name>.jsonl:       one compact line per (metric, item) as soon as it is final,
+    #                       plus one {"metric", "meta"} line per metric (the last one wins)
+    # - <name>.texts.jsonl: {"id", "text"} for every text referenced by the rows
+    # read_results() rebuilds the usual {"metrics": ..., "meta": ...} structure, also from a partial run
+
+    def __init__(self, path):
+        self.rows_path, self.texts_path = stream_paths(path)
+        os.makedirs(os.path.dirname(self.rows_path) or '.', exist_ok=True)
+        self.seen = set()
+        self.rows = open(self.rows_path, 'w', encoding='utf-8')
+        self.texts = open(self.texts_path, 'w', encoding='utf-8')
+
+    def add(self, metric, row, trial=None):
+        row = dict(row)
+        for field in TEXT_FIELDS:
+            text = row.get(field)
+            if isinstance(text, str):
+                row[field] = text_id(text)
+                if row[field] not in self.seen:
+                    self.seen.add(row[field])
+                    self.texts.write(dumps({"id": row[field], "text": text}) + '\n')
+        # texts first, so that a row never references a text missing from disk
+        self.texts.flush()
+        record = {"metric": metric, "row": row}
+        if trial is not None:
+            record["trial"] = trial
+        self.rows.write(dumps(record) + '\n')
+        self.rows.flush()
+
+    def meta(self, metric, value):
+        self.rows.write(dumps({"metric": metric, "meta": value}) + '\n')
+        self.rows.flush()
+
+    def close(self):
+        self.rows.close()
+        self.texts.close()
+
+
+def read_jsonl(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # last line of a run still being written (or killed)
+                continue
+
+
+def read_results(path):
+    rows_path, texts_path = stream_paths(path)
+    texts = {record['id']: record['text'] for record in read_jsonl(texts_path)}
+    metrics = {}
+    meta = {}
+    for record in read_jsonl(rows_path):
+        metric = record['metric']
+        if 'meta' in record:
+            meta[metric] = record['meta']
+            continue
+        row = record['row']
+        for field in TEXT_FIELDS:
+            if row.get(field) in texts:
+                row[field] = texts[row[field]]
+        if 'trial' in record:
+            # prompt_assessment: metrics[prompt] is a list of trials
+            trials = metrics.setdefault(metric, [])
+            while len(trials) <= record['trial']:
+                trials.append([])
+            trials[record['trial']].append(row)
+        else:
+            metrics.setdefault(metric, []).append(row)
+    return {"metrics": metrics, "meta": meta}
+
+
+if __name__ == "__main__":
+    # e.g. python -m lib.results_stream output/evaluations/metrics/v2/results.jsonl [results.json]
+    # rebuilds the results.json read by the fill-table scripts
+    rows_path = sys.argv[1]
+    out_path = sys.argv[2] if len(sys.argv) > 2 else stream_paths(rows_path)[0][:-len('.jsonl')] + '.json'
+    with open(out_path, 'w') as f:
+        json.dump(read_results(rows_path), f, indent=4)
+    print(f"Output written to {out_path}")
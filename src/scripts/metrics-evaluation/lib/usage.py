@@ -0,0 +1,116 @@
+from collections import defaultdict
+import numpy as np
+import json
+import os
+
+# USD per 1M tokens: (input, cached input, output). List prices, to be updated when they change;
+# models missing here are reported without a cost
+PRICES = {
+    'gpt-5': (1.25, 0.125, 10.0),
+    'gpt-5-mini': (0.25, 0.025, 2.0),
+    'gpt-5-nano': (0.05, 0.005, 0.4),
+    'gpt-4.1': (2.0, 0.5, 8.0),
+    'gpt-4.1-mini': (0.4, 0.1, 1.6),
+    'gpt-4o': (2.5, 1.25, 10.0),
+    'gpt-4o-mini': (0.15, 0.075, 0.6),
+    'mistral-small-latest': (0.1, 0.1, 0.3),
+    'mistral-medium-latest': (0.4, 0.4, 2.0),
+    'mistral-large-latest': (2.0, 2.0, 6.0),
+}
+# provider batch endpoints bill half the synchronous price
+BATCH_DISCOUNT = 0.5
+
+
+def _get(obj, name):
+    # usage objects are SDK models for synchronous calls, plain dicts in batch output files
+    if obj is None:
+        return None
+    return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+
+
+def usage_from_response(response):
+    usage = _get(response, 'usage')
+    details = _get(usage, 'prompt_tokens_details') or _get(usage, 'prompt_token_details')
+    return {
+        "prompt_tokens": _get(usage, 'prompt_tokens') or 0,
+        "completion_tokens": _get(usage, 'completion_tokens') or 0,
+        "cached_tokens": _get(details, 'cached_tokens') or 0,
+    }
+
+
+def call_cost(model, usage, batch=False):
+    if model not in PRICES:
+        return None
+    input_price, cached_price, output_price = PRICES[model]
+    uncached = usage["prompt_tokens"] - usage["cached_tokens"]
+    cost = (uncached * input_price + usage["cached_tokens"] * cached_price + usage["completion_tokens"] * output_price) / 1e6
+    return cost * BATCH_DISCOUNT if batch else cost
+
+
+class UsageTracker:
+    # one record per provider call (cache hits are not calls), aggregated per (label, model):
+    # label is the metric or prompt version the call was made for
+
+    def __init__(self):
+        self.records = defaultdict(list)
+
+    def record(self, label, model, usage, latency, attempts=1, ok=True, batch=False):
+        # latency is None for batched requests: they only have the turnaround of their whole job
+        usage = usage or {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+        self.records[(label, model)].append({
+            **usage,
+            "latency": latency,
+            "attempts": attempts,
+            "ok": ok,
+            "cost": call_cost(model, usage, batch),
+        })
+
+    @staticmethod
+    def aggregate(records):
+        timed = [r for r in records if r["latency"] is not None]
+        latencies = np.array([r["latency"] for r in timed])
+        completion_tokens = sum(r["completion_tokens"] for r in records)
+        costs = [r["cost"] for r in records]
+        return {
+            "calls": len(records),
+            "failed": sum(not r["ok"] for r in records),
+            "retries": sum(r["attempts"] - 1 for r in records),
+            "prompt_tokens": sum(r["prompt_tokens"] for r in records),
+            "cached_tokens": sum(r["cached_tokens"] for r in records),
+            "completion_tokens": completion_tokens,
+            "latency_p50": float(np.percentile(latencies, 50)) if timed else None,
+            "latency_p95": float(np.percentile(latencies, 95)) if timed else None,
+            # output tokens per second of call time, a per-request speed (concurrency not included)
+            "tokens_per_sec": (
+                sum(r["completion_tokens"] for r in timed) / latencies.sum() if timed and latencies.sum() > 0 else None
+            ),
+            "cost": None if None in costs else sum(costs),
+        }
+
+    def to_dict(self):
+        groups = {f"{label} | {model}": self.aggregate(records) for (label, model), records in self.records.items()}
+        all_records = [r for records in self.records.values() for r in records]
+        if all_records:
+            groups["TOTAL"] = self.aggregate(all_records)
+        return groups
+
+    def report(self):
+        groups = self.to_dict()
+        if not groups:
+            return "Usage: no provider calls"
+        lines = ["Usage:"]
+        for name, g in groups.items():
+            cost = f"${g['cost']:.4f}" if g['cost'] is not None else "n/a"
+            latency = f"{g['latency_p50']:.2f}s/{g['latency_p95']:.2f}s" if g['latency_p50'] is not None else "n/a"
+            speed = f"{g['tokens_per_sec']:.1f} tok/s" if g['tokens_per_sec'] is not None else "n/a tok/s"
+            lines.append(
+                f"  {name:<40} | Calls: {g['calls']} (failed {g['failed']}, retries {g['retries']}) | "
+                f"Tokens in/cached/out: {g['prompt_tokens']}/{g['cached_tokens']}/{g['completion_tokens']} | "
+                f"Latency p50/p95: {latency} | {speed} | Cost: {cost}"
+            )
+        return '\n'.join(lines)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=4)
@@ -1,26 +1,37 @@
-from metrics_assessment import compute_best_threshold
-from mistralai import Mistral
-from lib.data_loader import load_metrics_tests
-from lib.llm_metrics_prompts import build_prompt
+from lib.evaluation import compute_best_threshold, binarize
+from lib.dataset import Dataset
+from lib.llm_metrics_prompts import build_prompt, build_group_prompt, prompt_token_counts
+from lib.group_judging import GroupJudge, GROUP_SIZE
+from lib.llm_engine import JudgeEngine, get_provider
+from lib.batch_api import BatchRunner, get_batch_backend
+from lib.response_cache import ResponseCache
+from lib.checkpoint import Journal, content_hash
+from lib.dedup import Deduplicator
+from lib.results_stream import ResultsWriter
+from lib.results_store import write_results, RESULTS_STORE_DIR
+from lib.usage import UsageTracker
+from lib.cascade import Cascade, ZeroMainRule, CheapMetricRule, cheap_scores, CASCADE_BAND
 from collections import defaultdict
 from pydantic import BaseModel
 from tqdm import tqdm
 import os
 import json
 import sys
-from dotenv import load_dotenv
-from openai import OpenAI
-load_dotenv('.env')
 
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-mistral_client = Mistral(api_key=os.getenv("MISTRAL_API_KEY"))
+class EvalResult(BaseModel):
+    score: float
+    explanation: str
+
+class EvalResultLLMMainSub(BaseModel):
+    score_main: float
+    score_sub: float
+    explanation: str
 
 def main():
 
-    metrics_tests = load_metrics_tests()
+    dataset = Dataset.load()
     metrics_results = defaultdict(list)
     metrics_meta = {}
-    llm_sub_zero_set = set()
     merge_main_sub = "--merge-main-sub" in sys.argv
     
     # we have to get -m model and -p provider from command line args
@@ -46,97 +57,154 @@ def main():
     else:
         raise ValueError("Version must be specified with -v argument")
 
+    base_dir = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..'))
+    output_dir = os.path.normpath(os.path.join(base_dir, 'output', 'evaluations', 'metrics', 'v2'))
+    store_dir = os.path.normpath(os.path.join(base_dir, RESULTS_STORE_DIR))
+    run_name = f'{"-main-sub-merged" if merge_main_sub else ""}-{model_name}-{provider_name}-v={version}-llm'
+
+    # every judged item is journaled; --resume continues a killed run from the last completed item
+    journal = Journal(os.path.join(output_dir, f'journal{run_name}.jsonl'), resume="--resume" in sys.argv)
+
+    # optional: -c max requests in flight (default 16), --rps provider rate limit (requests per second),
+    # --no-cache to always query the provider (e.g. to measure run-to-run variance)
+    concurrency = int(sys.argv[sys.argv.index("-c") + 1]) if "-c" in sys.argv else 16
+    requests_per_second = float(sys.argv[sys.argv.index("--rps") + 1]) if "--rps" in sys.argv else None
+    response_cache = ResponseCache(enabled="--no-cache" not in sys.argv)
+    # --stream: rows go to results{run_name}.jsonl (+ .texts.jsonl) as each metric is scored, instead of
+    # one results{run_name}.json at the end (python -m lib.results_stream <path> rebuilds the json)
+    writer = ResultsWriter(os.path.join(output_dir, f'results{run_name}.jsonl')) if "--stream" in sys.argv else None
+    # --parquet: also write every metric to the Parquet results store (see query_results.py)
+    parquet = "--parquet" in sys.argv
+    # --batch-mode: one provider batch job per metric instead of synchronous calls (nightly runs;
+    # -p mock uses a local file-based fake of the batch endpoints)
+    batch_mode = "--batch-mode" in sys.argv
+    # tokens, latency and cost of every provider call, reported per metric at the end (usage{run_name}.json)
+    usage = UsageTracker()
+    if batch_mode:
+        engine = BatchRunner(get_batch_backend(provider_name), cache=response_cache, usage=usage)
+    else:
+        engine = JudgeEngine(
+            get_provider(provider_name),
+            concurrency=concurrency,
+            requests_per_second=requests_per_second,
+            cache=response_cache,
+            usage=usage
+        )
+
+    # --group-judging: one call judges up to GROUP_SIZE candidates of the same test (same query and references),
+    # candidates missing from the grouped answer are judged one by one
+    group_judge = GroupJudge(engine) if "--group-judging" in sys.argv else None
+
+    # items settled without a judge call: llm_sub of answers judged 0 on llm_main, and with --cascade <metric>
+    # [--band <w>] every item a cheap local metric scores farther than w from its calibrated threshold
+    # (metrics_assessment.py results; python -m lib.cascade sweeps the band against a judge-only run)
+    rules = [ZeroMainRule()]
+    if "--cascade" in sys.argv:
+        cheap_metric = sys.argv[sys.argv.index("--cascade") + 1]
+        band = float(sys.argv[sys.argv.index("--band") + 1]) if "--band" in sys.argv else CASCADE_BAND
+        scores, threshold = cheap_scores(dataset, cheap_metric)
+        print(f"Cascade: {cheap_metric} threshold {threshold:.4f}, uncertainty band ±{band}")
+        rules.append(CheapMetricRule(cheap_metric, scores, threshold, band))
+    cascade = Cascade(rules)
+
     METRICS = ['llm_full', 'llm_main', 'llm_sub']
+    dedup = Deduplicator()
 
     for metric in tqdm(METRICS):
     
         if merge_main_sub and metric == 'llm_sub':
             print(f"Skipping {metric} because --merge-main-sub is set")
             continue
-            
-        batch_data = []
-        for group_name, tests in metrics_tests.items():
-            question_test = tests['Test']
-            key_ref = tests['KeyRef']
-            full_ref = tests['FullRef']
-            answer_candidates = tests['Candidates']
-            main_cat = tests.get('MainCategory')
-            sub_cat = tests.get('SubCategory')
-                
-            for candidate in answer_candidates:
-                batch_data.append({
-                    'group_name': group_name,
-                    'question_test': question_test,
-                    'key_ref': key_ref,
-                    'full_ref': full_ref,
-                    'candidate': candidate,
-                    'main_cat': main_cat,
-                    'sub_cat': sub_cat
-                })
-
-
-        raw_scores = []
-        raw_scores_two = []
-
-        for item in batch_data:
-
-            metric_type = 'llm_main_sub' if (metric == 'llm_main' and merge_main_sub) else metric
-
-            query = item['question_test']
-            key_ref = item['key_ref']
-            full_ref = item['full_ref']
-            provided_answer = item['candidate']['Candidate']
-
-            if metric_type == 'llm_sub':
-                if provided_answer in llm_sub_zero_set:
-                    print('Skipping LLM Sub evaluation for answer that got 0 in LLM Main:', provided_answer)
-                    raw_scores.append(0)
-                    continue
+
+
+        metric_type = 'llm_main_sub' if (metric == 'llm_main' and merge_main_sub) else metric
+        response_format = EvalResult if metric_type != 'llm_main_sub' else EvalResultLLMMainSub
+
+        raw_scores = [None] * len(dataset)
+        raw_scores_two = [None] * len(dataset)
+        evaluations = [None] * len(dataset)
+        requests = []
+        pending = []
+
+        def journal_key(index, prompt):
+            # the prompt hash covers texts and prompt version: edited items are judged again on --resume
+            item = dataset.items[index]
+            return (metric_type, dataset.group(item), item.candidate_index, content_hash(prompt))
+
+        for index, item in enumerate(dataset):
+
+            query = dataset.test(item)
+            key_ref = dataset.reference(item, 'key')
+            full_ref = dataset.reference(item, 'full')
+            provided_answer = dataset.candidate(item)
+
+            decided = cascade.decide(metric_type, item)
+            if decided is not None:
+                raw_scores[index] = decided
+                raw_scores_two[index] = decided
+                continue
 
             prompt = build_prompt(metric_type, query, key_ref, full_ref, provided_answer)
-            
-            class EvalResult(BaseModel):
-                score: float
-                explanation: str
-
-            class EvalResultLLMMainSub(BaseModel):
-                score_main: float
-                score_sub: float
-                explanation: str
-            
-            if provider_name == 'openai':
-                response = openai_client.chat.completions.parse(
-                    model=model_name,
-                    messages=[
-                        {"role": "user", "content": prompt}
-                    ],
-                    response_format=EvalResult if metric_type != 'llm_main_sub' else EvalResultLLMMainSub
-                )
-            elif provider_name == 'mistral':
-                response = mistral_client.chat.parse(
-                    model=model_name,
-                    messages=[
-                        {"role": "user", "content": prompt}
-                    ],
-                    response_format=EvalResult if metric_type != 'llm_main_sub' else EvalResultLLMMainSub
-                )
-                
-            evaluation = response.choices[0].message.parsed
+            if journal_key(index, prompt) in journal:
+                evaluations[index] = response_format.model_validate(journal.get(journal_key(index, prompt)))
+                continue
+
+            requests.append((prompt, response_format))
+            pending.append(index)
+
+        if requests:
+            # every prompt of a type shares the same static prefix (cacheable provider-side), items only change the suffix
+            prefix_tokens, suffix_tokens = prompt_token_counts(metric_type, [prompt for prompt, _ in requests])
+            print(f"{metric_type} prompts: static prefix ~{prefix_tokens} tokens, dynamic suffix ~{suffix_tokens:.0f} tokens on average")
+
+        # the prompt holds query, references, answer and prompt version: identical prompts are judged once
+        unique, inverse = dedup.collapse(metric_type, [prompt for prompt, _ in requests])
+        fan_out = Deduplicator.fan_out(inverse)
+
+        def on_result(position, evaluation):
+            if evaluation is not None:
+                for pending_position in fan_out[position]:
+                    journal.record(journal_key(pending[pending_position], requests[pending_position][0]), evaluation.model_dump())
+
+        unique_requests = [requests[p] for p in unique]
+        if group_judge is not None:
+            by_test = defaultdict(list) # (test, key ref, full ref) -> unique request positions
+            for position, p in enumerate(unique):
+                item = dataset.items[pending[p]]
+                by_test[(item.test_id, item.key_ref_id, item.full_ref_id)].append(position)
+            groups = []
+            for positions in by_test.values():
+                for start in range(0, len(positions), GROUP_SIZE):
+                    chunk = positions[start:start + GROUP_SIZE]
+                    item = dataset.items[pending[unique[chunk[0]]]]
+                    prompt = build_group_prompt(
+                        metric_type, dataset.test(item), dataset.reference(item, 'key'), dataset.reference(item, 'full'),
+                        [dataset.candidate(dataset.items[pending[unique[position]]]) for position in chunk]
+                    )
+                    groups.append((prompt, response_format, chunk))
+            results = group_judge.run(model_name, groups, unique_requests, desc=f'Judging {metric_type}', on_result=on_result, label=metric_type)
+        else:
+            results = engine.run(model_name, unique_requests, desc=f'Judging {metric_type}', on_result=on_result, label=metric_type)
+        for index, evaluation in zip(pending, Deduplicator.expand(results, inverse)):
+            evaluations[index] = evaluation
+
+        for item, evaluation in zip(dataset, evaluations):
+            index = item.index
+
+            if evaluation is None:
+                # skipped, or the request failed after all retries: the item stays unscored
+                continue
 
             if metric_type != 'llm_main_sub':
-                score = evaluation.score
-                raw_scores.append(score)
-                if metric_type == 'llm_main' and score == 0:
-                    print('Adding to LLM Sub zero set:', provided_answer)
-                    llm_sub_zero_set.add(provided_answer)
+                raw_scores[index] = evaluation.score
+                cascade.observe(metric_type, item, evaluation.score)
 
             if metric_type == 'llm_main_sub':
-                raw_scores.append(evaluation.score_main)
-                raw_scores_two.append(evaluation.score_sub)
+                raw_scores[index] = evaluation.score_main
+                raw_scores_two[index] = evaluation.score_sub
 
-            
         def store_in_metrics_results(_raw_scores, _metric):
-            expected_binaries = [item['candidate']['Binary'] for item in batch_data]
+            expected_binaries = dataset.expected_binaries()
             threshold, best_f1 = compute_best_threshold(_raw_scores, expected_binaries)
 
             metrics_meta[_metric] = {
@@ -144,38 +212,57 @@ def main():
                 "best_f1": best_f1,
             }
 
-            for item, rf in zip(batch_data, _raw_scores):
-                candidate = item['candidate']
-                binary_pred = None
-                if candidate['Binary'] is not None:
-                    binary_pred = int(rf >= threshold) if rf is not None else None
-
-                metrics_results[_metric].append({
-                    "group": item['group_name'],
-                    "test": item['question_test'],
-                    "main_category": item['main_cat'],
-                    "sub_category": item['sub_cat'],
-                    "candidate": candidate['Candidate'],
-                    "expected_continuous": candidate['Continuous'],
-                    "expected_binary": candidate['Binary'],
+            binary_preds = binarize(_raw_scores, threshold)
+            if writer is not None:
+                writer.meta(_metric, metrics_meta[_metric])
+            rows = []
+
+            for item, rf, bp in zip(dataset, _raw_scores, binary_preds):
+                binary_pred = bp if item.binary is not None else None
+
+                row = {
+                    **dataset.row(item),
                     "result_continuous": rf,
                     "result_binary": binary_pred,
                     "threshold": threshold,
-                })
+                }
+                if writer is not None:
+                    writer.add(_metric, row)
+                else:
+                    metrics_results[_metric].append(row)
+                rows.append(row)
+
+            if parquet:
+                merged = "-main-sub-merged" if merge_main_sub else ""
+                write_results({_metric: rows}, model=model_name, provider=provider_name, version=f'{version}{merged}', root=store_dir)
         if merge_main_sub and metric != 'llm_full':
             store_in_metrics_results(raw_scores, 'llm_main')
             store_in_metrics_results(raw_scores_two, 'llm_sub')
         else:
             store_in_metrics_results(raw_scores, metric)
 
-    base_dir = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..'))
-    output_dir = os.path.normpath(os.path.join(base_dir, 'output', 'evaluations', 'metrics', 'v2'))
+    journal.close()
     os.makedirs(output_dir, exist_ok=True)
-    results_path = os.path.normpath(os.path.join(output_dir, f'results{"-main-sub-merged" if merge_main_sub else ""}-{model_name}-{provider_name}-v={version}-llm.json'))
-    with open(results_path, 'w') as f:
-        json.dump({"metrics": metrics_results, "meta": metrics_meta}, f, indent=4)
+    if writer is not None:
+        writer.close()
+        results_path = writer.rows_path
+    else:
+        results_path = os.path.normpath(os.path.join(output_dir, f'results{run_name}.json'))
+        with open(results_path, 'w') as f:
+            json.dump({"metrics": metrics_results, "meta": metrics_meta}, f, indent=4)
     
     print(f"Output written to {results_path}")
+    if batch_mode:
+        print(f"LLM batches: {engine.summary()}")
+    else:
+        print(f"LLM calls: {engine.scheduler.stats.summary()}")
+    print(usage.report())
+    usage.save(os.path.join(output_dir, f'usage{run_name}.json'))
+    print(response_cache.summary())
+    print(dedup.summary())
+    print(cascade.summary())
+    if group_judge is not None:
+        print(f"Grouped judging: {group_judge.summary()}")
     
     if sys.platform == "darwin":
         cmd = 'say "Valutazione conclusa"'
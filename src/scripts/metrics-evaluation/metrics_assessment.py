@@ -2,18 +2,25 @@
 Nota: Esegui con CUDA_VISIBLE_DEVICES="" python src/scripts/metrics-evaluation/main.py per evitare di usare la GPU
 """
 
-from lib.data_loader import load_metrics_tests
-from lib.metrics.index import METRICS
-from lib.metrics.utils import HUGGINGFACE
+from lib.dataset import Dataset, REF_MODES
+from lib.metrics.index import load_metrics
+from lib.metrics.runner import score_pairs
+from lib.metrics.parallel import MetricScheduler
+from lib.checkpoint import Journal, content_hash
+from lib.dedup import Deduplicator
+from lib.evaluation import compute_best_threshold, binarize, summarize_results
+from lib.bootstrap import bootstrap_results, format_ci
+from lib.results_stream import ResultsWriter
+from lib.results_store import write_results
 from tqdm import tqdm
-import evaluate
-from collections import defaultdict
 import os
 import json
+import sys
 
 TO_NORMALIZE = {'bleurt', 'unieval', 'bertscore', 'embedding_gemma'}
 USE_CACHE = False
-CACHE = {}
+OUTPUT_DIR = 'output/evaluations/metrics/v2'
+JOURNAL_PATH = 'output/evaluations/metrics/v2/journal.jsonl'
 
 def normalize_scores(metric_name, raw_scores):
     if metric_name not in TO_NORMALIZE:
@@ -27,222 +34,201 @@ def normalize_scores(metric_name, raw_scores):
     rng = vmax - vmin
     return [(x - vmin) / rng if x is not None else None for x in raw_scores], {"method": "minmax", "min": vmin, "max": vmax}
 
-def add_to_cache(metric_name, meta, results):
-    global CACHE
-    CACHE[metric_name] = {
-        'meta': meta,
-        'results': results
-    }
-    os.makedirs('output/evaluations/metrics/v2', exist_ok=True)
-    with open(f'output/evaluations/metrics/v2/cache.json', 'w') as f:
-        json.dump(CACHE, f, indent=4)
-
-def load_cache():
-    global CACHE
-    if os.path.exists(f'output/evaluations/metrics/v2/cache.json'):
-        with open(f'output/evaluations/metrics/v2/cache.json', 'r') as f:
-            CACHE = json.load(f)
-    else:
-        CACHE = {}
-
-def compute_best_threshold(scores, labels):
-    filtered = [(s, l) for s, l in zip(scores, labels) if l is not None]
-    if not filtered:
-        return 0.5, 0.0
-    filtered.sort(key=lambda x: x[0], reverse=True)
-    total_pos = sum(1 for _, l in filtered if l == 1)
-    if total_pos == 0:
-        return 0.5, 0.0
-    tp = 0
-    best_f1 = -1.0
-    best_idx = 0
-    for i, (_, label) in enumerate(filtered):
-        if label == 1:
-            tp += 1
-        k = i + 1
-        precision = tp / k
-        recall = tp / total_pos
-        f1 = 0.0 if (precision + recall) == 0 else 2 * precision * recall / (precision + recall)
-        if f1 > best_f1:
-            best_f1 = f1
-            best_idx = i
-    if best_idx < len(filtered) - 1:
-        th = (filtered[best_idx][0] + filtered[best_idx + 1][0]) / 2
-    else:
-        th = filtered[best_idx][0] - 1e-6
-    return th, best_f1
+def summary_lines(metric_name, results, meta, n_resamples=0, bootstrap_workers=1):
+    lines = []
+    for mode, ref_mode in [("fullref", "full"), ("keyref", "key")]:
+        summary = summarize_results(results, f"result_continuous_{mode}", f"result_binary_{mode}")
+        lines.append(
+            f"[{mode.upper()}] Metric: {metric_name:<20} | "
+            f"Continuous Score: {summary['continuous']:.4f} | "
+            f"Binary F1: {summary['f1']:.4f} | Binary Accuracy: {summary['accuracy']:.4f} | "
+            f"Threshold: {meta.get(f'threshold_{ref_mode}', 0.5):.4f}"
+        )
+
+        if n_resamples:
+            ci = bootstrap_results(
+                results, f"result_continuous_{mode}", f"result_binary_{mode}",
+                n_resamples=n_resamples, workers=bootstrap_workers
+            )
+            lines.append(f"[{mode.upper()}] {'':<28} {format_ci(ci)}")
+    return lines
 
 def main():
-    metrics_tests = load_metrics_tests()
-    metrics_results = defaultdict(list)
+    # e.g. python metrics_assessment.py --metrics bleurt,rouge_recall [--resume] [--bootstrap 1000 [--workers 4]]
+    #      [--processes 4 [--memory-budget 4000]] to score metrics in parallel worker processes (budget in MB per worker)
+    #      [--stream] to write results.jsonl + results.texts.jsonl row by row instead of results.json
+    #      (python -m lib.results_stream output/evaluations/metrics/v2/results.jsonl rebuilds results.json)
+    #      [--parquet] to also write each metric to the Parquet results store (see query_results.py)
+    metric_names = None
+    if "--metrics" in sys.argv:
+        metric_names = sys.argv[sys.argv.index("--metrics") + 1].split(',')
+    n_resamples = int(sys.argv[sys.argv.index("--bootstrap") + 1]) if "--bootstrap" in sys.argv else 0
+    bootstrap_workers = int(sys.argv[sys.argv.index("--workers") + 1]) if "--workers" in sys.argv else 1
+    processes = int(sys.argv[sys.argv.index("--processes") + 1]) if "--processes" in sys.argv else 1
+    memory_budget = int(sys.argv[sys.argv.index("--memory-budget") + 1]) if "--memory-budget" in sys.argv else None
+    METRICS = load_metrics(metric_names)
+    print("Loaded metrics:", list(METRICS.keys()))
+
+    dataset = Dataset.load()
+    metrics_results = {}
     metrics_meta = {}
-    if USE_CACHE:
-        load_cache()
-    
-    with tqdm(total=len(METRICS), desc='Evaluating metrics') as pbar:
-        for metric_name, metric in METRICS.items():
-            pbar.set_description(f"Evaluating metric: {metric_name}")
-            
-            if metric_name in CACHE:
-                print(f"Using cached results for metric: {metric_name}")
-                metrics_meta[metric_name] = CACHE[metric_name]['meta']
-                metrics_results[metric_name] = CACHE[metric_name]['results']
-                pbar.update(1)
-                continue
-            
-            batch_data = []
-            for group_name, tests in metrics_tests.items():
-                question_test = tests['Test']
-                key_ref = tests['KeyRef']
-                answer_reference = tests['FullRef']
-                answer_candidates = tests['Candidates']
-                main_cat = tests.get('MainCategory')
-                sub_cat = tests.get('SubCategory')
-                
-                for candidate in answer_candidates:
-                    batch_data.append({
-                        'group_name': group_name,
-                        'question_test': question_test,
-                        'key_ref': key_ref,
-                        'answer_reference': answer_reference,
-                        'candidate': candidate,
-                        'main_cat': main_cat,
-                        'sub_cat': sub_cat
-                    })
-            
-            refs_full = [item['answer_reference'] for item in batch_data]
-            refs_key = [item['key_ref'] for item in batch_data]
-            predictions = [item['candidate']['Candidate'] for item in batch_data]
-            
-            if metric['function'] == HUGGINGFACE:
-                print(f"Metric {metric_name} is a HuggingFace metric, BATCH PROCESSING IT...")
-                results_full = evaluate.load(metric_name).compute(
-                    references=refs_full, 
-                    predictions=predictions,
-                    **({"lang": "it"} if metric_name == 'bertscore' else {}),
-                    **({"sources": refs_full} if metric_name == 'comet' else {})
-                )
-                results_key = evaluate.load(metric_name).compute(
-                    references=refs_key, 
-                    predictions=predictions,
-                    **({"lang": "it"} if metric_name == 'bertscore' else {}),
-                    **({"sources": refs_key} if metric_name == 'comet' else {})
-                )
-                result_key = metric['result_key']
-                raw_scores_full = results_full[result_key]
-                raw_scores_key = results_key[result_key]
-            else:
-                print(f"Metric {metric_name} is a custom function, PROCESSING ITEM BY ITEM...")
-                raw_scores_full = []
-                raw_scores_key = []
-                result_key = metric['result_key']
-                function = metric['function']
-                for item in batch_data:
-                    r_full = function(references=[item['answer_reference']], predictions=[item['candidate']['Candidate']])
-                    r_key = function(references=[item['key_ref']], predictions=[item['candidate']['Candidate']])
-                    raw_scores_full.append(r_full[result_key])
-                    raw_scores_key.append(r_key[result_key])
-
-            norm_full, meta_full = normalize_scores(metric_name, raw_scores_full)
-            norm_key, meta_key = normalize_scores(metric_name, raw_scores_key)
-            
-            expected_binaries = [item['candidate']['Binary'] for item in batch_data]
-            threshold_full, best_f1_full = compute_best_threshold(norm_full, expected_binaries)
-            threshold_key, best_f1_key = compute_best_threshold(norm_key, expected_binaries)
+    # with --stream each metric's rows go to disk as soon as the metric is scored and are not kept in memory
+    writer = ResultsWriter(os.path.join(OUTPUT_DIR, 'results.jsonl')) if "--stream" in sys.argv else None
+    parquet = "--parquet" in sys.argv
+    summaries = {}
+    # every computed score is journaled; with --resume (or USE_CACHE) a killed run picks up where it stopped
+    journal = Journal(JOURNAL_PATH, resume=USE_CACHE or "--resume" in sys.argv)
+
+    refs = {mode: dataset.references(mode) for mode in REF_MODES}
+    predictions = dataset.predictions()
+
+    raw_scores = {}
+
+    def finish(metric_name):
+        # rows, threshold and summary of a metric whose scores are all in; its raw scores are released
+        raw_scores_full = raw_scores[metric_name]['full']
+        raw_scores_key = raw_scores[metric_name]['key']
+
+        norm_full, meta_full = normalize_scores(metric_name, raw_scores_full)
+        norm_key, meta_key = normalize_scores(metric_name, raw_scores_key)
+        
+        expected_binaries = dataset.expected_binaries()
+        threshold_full, best_f1_full = compute_best_threshold(norm_full, expected_binaries)
+        threshold_key, best_f1_key = compute_best_threshold(norm_key, expected_binaries)
+        
+        metrics_meta[metric_name] = {
+            "threshold_full": threshold_full,
+            "threshold_key": threshold_key,
+            "best_f1_full": best_f1_full,
+            "best_f1_key": best_f1_key,
+            "normalization_full": meta_full,
+            "normalization_key": meta_key
+        }
+
+        binary_preds_full = binarize(norm_full, threshold_full)
+        binary_preds_key = binarize(norm_key, threshold_key)
+
+        results = []
+        for item, rf, rk, nf, nk, bf, bk in zip(dataset, raw_scores_full, raw_scores_key, norm_full, norm_key, binary_preds_full, binary_preds_key):
+            binary_pred_full = bf if item.binary is not None else None
+            binary_pred_key = bk if item.binary is not None else None
             
-            metrics_meta[metric_name] = {
+            results.append({
+                **dataset.row(item),
+                "result_continuous_fullref_raw": rf,
+                "result_continuous_keyref_raw": rk,
+                "result_continuous_fullref": nf,
+                "result_continuous_keyref": nk,
+                "result_binary_fullref": binary_pred_full,
+                "result_binary_keyref": binary_pred_key,
                 "threshold_full": threshold_full,
-                "threshold_key": threshold_key,
-                "best_f1_full": best_f1_full,
-                "best_f1_key": best_f1_key,
-                "normalization_full": meta_full,
-                "normalization_key": meta_key
-            }
-
-            for item, rf, rk, nf, nk in zip(batch_data, raw_scores_full, raw_scores_key, norm_full, norm_key):
-                candidate = item['candidate']
-                binary_pred_full = None
-                binary_pred_key = None
-                if candidate['Binary'] is not None:
-                    binary_pred_full = int(nf >= threshold_full) if nf is not None else None
-                    binary_pred_key = int(nk >= threshold_key) if nk is not None else None
-                
-                metrics_results[metric_name].append({
-                    "group": item['group_name'],
-                    "test": item['question_test'],
-                    "main_category": item['main_cat'],
-                    "sub_category": item['sub_cat'],
-                    "candidate": candidate['Candidate'],
-                    "expected_continuous": candidate['Continuous'],
-                    "expected_binary": candidate['Binary'],
-                    "result_continuous_fullref_raw": rf,
-                    "result_continuous_keyref_raw": rk,
-                    "result_continuous_fullref": nf,
-                    "result_continuous_keyref": nk,
-                    "result_binary_fullref": binary_pred_full,
-                    "result_binary_keyref": binary_pred_key,
-                    "threshold_full": threshold_full,
-                    "threshold_key": threshold_key
-                })
+                "threshold_key": threshold_key
+            })
+
+        summaries[metric_name] = summary_lines(metric_name, results, metrics_meta[metric_name], n_resamples, bootstrap_workers)
+        if parquet:
+            # reference-based metrics have no judge model / provider
+            write_results({metric_name: results}, model='none', provider='local', version='v2')
+        if writer is not None:
+            writer.meta(metric_name, metrics_meta[metric_name])
+            for row in results:
+                writer.add(metric_name, row)
+        else:
+            metrics_results[metric_name] = results
+        del raw_scores[metric_name]
+
+    jobs = []
+    dedup = Deduplicator()
+
+    def journal_key(metric_name, index, mode):
+        item = dataset.items[index]
+        return (metric_name, dataset.group(item), item.candidate_index, mode, content_hash(refs[mode][index], predictions[index]))
+
+    for metric_name, metric in METRICS.items():
+        raw_scores[metric_name] = {mode: [None] * len(dataset) for mode in REF_MODES}
+        pending = [] # (item index, ref mode) not in the journal yet
+        for index, item in enumerate(dataset):
+            for mode in REF_MODES:
+                if journal_key(metric_name, index, mode) in journal:
+                    raw_scores[metric_name][mode][index] = journal.get(journal_key(metric_name, index, mode))
+                else:
+                    pending.append((index, mode))
+
+        if not pending:
+            print(f"Using journaled results for metric: {metric_name}")
+            finish(metric_name)
+            continue
+
+        # full and key refs go through a single pass, scores are split back by (item, ref mode);
+        # identical (reference, prediction) pairs (repeated answers, key ref == full ref) are scored once
+        references = [refs[mode][index] for index, mode in pending]
+        candidates = [predictions[index] for index, _ in pending]
+        unique, inverse = dedup.collapse(metric_name, list(zip(references, candidates)))
+        jobs.append({
+            'metric_name': metric_name,
+            'metric': metric,
+            'pairs': pending,
+            'remaining': len(pending),
+            'fan_out': Deduplicator.fan_out(inverse),
+            'references': [references[p] for p in unique],
+            'predictions': [candidates[p] for p in unique],
+        })
+
+    def record(job, position, score):
+        for pair in job['fan_out'][position]:
+            index, mode = job['pairs'][pair]
+            raw_scores[job['metric_name']][mode][index] = score
+            journal.record(journal_key(job['metric_name'], index, mode), score)
+        job['remaining'] -= len(job['fan_out'][position])
+        if job['remaining'] == 0:
+            finish(job['metric_name'])
+
+    with tqdm(total=len(jobs), desc='Evaluating metrics') as pbar:
+        if processes > 1:
+            def on_shard(job_index, start, scores):
+                # shards can complete in any order: a job is done when all its pairs are recorded
+                for offset, score in enumerate(scores):
+                    record(jobs[job_index], start + offset, score)
+                if scores and jobs[job_index]['remaining'] == 0:
+                    pbar.update(1)
+
+            MetricScheduler(processes, memory_budget).run(jobs, on_shard)
+        else:
+            for job in jobs:
+                pbar.set_description(f"Evaluating metric: {job['metric_name']}")
+                score_pairs(
+                    job['metric_name'], job['references'], job['predictions'], metric=job['metric'],
+                    on_score=lambda position, score: record(job, position, score)
+                )
                 pbar.update(1)
-            
-            add_to_cache(metric_name, metrics_meta[metric_name], metrics_results[metric_name])
+    if jobs:
+        print(dedup.summary())
+
+    # metrics no job completed (failed scoring) still get their rows, unscored items as None
+    for metric_name in METRICS:
+        if metric_name not in metrics_meta:
+            finish(metric_name)
 
-    os.makedirs('output/evaluations/metrics/v2', exist_ok=True)
-    with open(f'output/evaluations/metrics/v2/results.json', 'w') as f:
-        json.dump({"metrics": metrics_results, "meta": metrics_meta}, f, indent=4)
+    journal.close()
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    if writer is not None:
+        writer.close()
+    else:
+        with open(os.path.join(OUTPUT_DIR, 'results.json'), 'w') as f:
+            metrics = {metric_name: metrics_results[metric_name] for metric_name in METRICS}
+            meta = {metric_name: metrics_meta[metric_name] for metric_name in METRICS}
+            json.dump({"metrics": metrics, "meta": meta}, f, indent=4)
 
     result_str = '='*50 + '\n' + "FINAL RESULTS" + '\n' + '='*50 + '\n'
     print("="*50)
     print("FINAL RESULTS")
     print("="*50)
     
-    for metric_name in metrics_results.keys():
-        results = metrics_results[metric_name]
-
-        for mode in ["fullref", "keyref"]:
-            total_continuous = 0.0
-            count_continuous = 0
-            total_binary = 0
-            correct_binary = 0
-            y_true = []
-            y_pred = []
-            
-            for res in results:
-                score = res[f"result_continuous_{mode}"]
-                if res['expected_continuous'] is not None and score is not None:
-                    total_continuous += 1 - abs(res['expected_continuous'] - score)
-                    count_continuous += 1
-                binary_pred = res[f"result_binary_{mode}"]
-                if res['expected_binary'] is not None and binary_pred is not None:
-                    total_binary += 1
-                    correct_binary += 1 if res['expected_binary'] == binary_pred else 0
-                    y_true.append(res['expected_binary'])
-                    y_pred.append(binary_pred)
-            
-            if y_true:
-                tp = sum(1 for t, p in zip(y_true, y_pred) if t == 1 and p == 1)
-                fp = sum(1 for t, p in zip(y_true, y_pred) if t == 0 and p == 1)
-                fn = sum(1 for t, p in zip(y_true, y_pred) if t == 1 and p == 0)
-                precision = tp / (tp + fp) if (tp + fp) > 0 else 0.0
-                recall = tp / (tp + fn) if (tp + fn) > 0 else 0.0
-                f1 = 2 * precision * recall / (precision + recall) if (precision + recall) > 0 else 0.0
-            else:
-                f1 = 0.0
-
-            final_continuous = total_continuous / count_continuous if count_continuous > 0 else 0.0
-            binary_accuracy = correct_binary / total_binary if total_binary > 0 else 0.0
-            meta = metrics_meta.get(metric_name, {})
-            
-            output = (
-                f"[{mode.upper()}] Metric: {metric_name:<20} | "
-                f"Continuous Score: {final_continuous:.4f} | "
-                f"Binary F1: {f1:.4f} | Binary Accuracy: {binary_accuracy:.4f} | "
-                f"Threshold: {meta.get(f'threshold_{mode}', 0.5):.4f}"
-            )
-            print(output)
-            result_str += output + '\n'
-        
+    for output in (line for metric_name in METRICS for line in summaries[metric_name]):
+        print(output)
+        result_str += output + '\n'
+
     out_dir = os.path.normpath(os.path.join('output', 'evaluations', 'metrics', 'v2'))
     os.makedirs(out_dir, exist_ok=True)
     final_path = os.path.join(out_dir, 'final_results.txt')
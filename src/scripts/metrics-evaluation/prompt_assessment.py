@@ -1,6 +1,13 @@
-from lib.data_loader import load_metrics_tests
+from lib.data_loader import load_prompt_optimization_tests
 from lib.data_loader import load_prompts
-from lib.metrics.llm_as_a_judge import llm_judge_custom
+from lib.dataset import Dataset
+from lib.dedup import Deduplicator
+from lib.metrics.llm_as_a_judge import llm_judge_custom, JUDGE_SCHEDULER, JUDGE_USAGE
+from lib.evaluation import compute_best_threshold, binarize, summarize_results
+from lib.bootstrap import bootstrap_results, format_ci
+from lib.resilience import is_provider_error
+from lib.results_stream import ResultsWriter
+from lib.results_store import write_results
 from tqdm import tqdm
 from dotenv import load_dotenv
 import os
@@ -13,6 +20,14 @@ USE_CACHE = True
 CACHE = {}
 ROOT_FOLDER = 'output/evaluations/metrics/prompt-optimization'
 NUM_TRIALS = 3
+# multi-trial runs measure the judge variance: they must always hit the provider
+USE_RESPONSE_CACHE = NUM_TRIALS == 1
+# bootstrap resamples of the first trial, for confidence intervals without extra LLM trials (0 = off)
+BOOTSTRAP_RESAMPLES = 1000
+# write results_{LANG}.jsonl (+ .texts.jsonl) trial by trial instead of results_{LANG}.json at the end
+STREAM_RESULTS = False
+# also write the trials to the Parquet results store (metric = prompt label, version = LANG)
+PARQUET_RESULTS = False
 
 def add_to_cache(metric_name, meta, results):
     global CACHE
@@ -38,45 +53,33 @@ def load_cache():
     else:
         CACHE = {}
 
-def compute_best_threshold(scores, labels):
-    filtered = [(s, l) for s, l in zip(scores, labels) if l is not None]
-    if not filtered:
-        return 0.5, 0.0
-    filtered.sort(key=lambda x: x[0], reverse=True)
-    total_pos = sum(1 for _, l in filtered if l == 1)
-    if total_pos == 0:
-        return 0.5, 0.0
-    tp = 0
-    best_f1 = -1.0
-    best_idx = 0
-    for i, (_, label) in enumerate(filtered):
-        if label == 1:
-            tp += 1
-        k = i + 1  # number of predicted positives at this cutoff
-        precision = tp / k
-        recall = tp / total_pos if total_pos > 0 else 0.0
-        if precision + recall == 0:
-            f1 = 0.0
-        else:
-            f1 = 2 * precision * recall / (precision + recall)
-        if f1 > best_f1:
-            best_f1 = f1
-            best_idx = i
-    if best_idx < len(filtered) - 1:
-        th = (filtered[best_idx][0] + filtered[best_idx + 1][0]) / 2
-    else:
-        th = filtered[best_idx][0] - 1e-6
-    return th, best_f1
-
 def main():
-    metrics_tests = load_metrics_tests(LANG)
+    # built once, shared by every prompt and trial
+    dataset = Dataset(load_prompt_optimization_tests(LANG))
+    dedup = Deduplicator()
     # metrics_results[prompt_name] => list of trials; each trial is a list of item-level results
+    # (not kept with STREAM_RESULTS: trials go to disk as they finish, only their summaries stay in memory)
     metrics_results = {}
+    # trial_summaries[prompt_name] => summarize_results of each trial; bootstrap_cis[prompt_name] => CI of trial 0
+    trial_summaries = {}
+    bootstrap_cis = {}
     # metrics_meta[prompt_name] => {"trials": [{"threshld":..., "best_f1":...}, ...]}
     metrics_meta = {}
     if USE_CACHE: load_cache()
     prompts_structure = load_prompts()
     prompts = prompts_structure['prompts']
+    writer = ResultsWriter(f'{ROOT_FOLDER}/results_{LANG}.jsonl') if STREAM_RESULTS else None
+
+    def finish_trial(prompt_name, trial_idx, trial_results):
+        trial_summaries.setdefault(prompt_name, []).append(summarize_results(trial_results, 'result_continuous', 'result_binary'))
+        if BOOTSTRAP_RESAMPLES and trial_idx == 0:
+            bootstrap_cis[prompt_name] = bootstrap_results(trial_results, 'result_continuous', 'result_binary', n_resamples=BOOTSTRAP_RESAMPLES)
+        if writer is not None:
+            writer.meta(prompt_name, metrics_meta[prompt_name])
+            for row in trial_results:
+                writer.add(prompt_name, row, trial=trial_idx)
+        else:
+            metrics_results.setdefault(prompt_name, []).append(trial_results)
 
     total_tasks = len(prompts) * NUM_TRIALS
     with tqdm(total=total_tasks, desc='Evaluating prompts') as pbar:
@@ -89,31 +92,19 @@ def main():
                 cached_meta = CACHE[prompt_name]['meta']
                 cached_results = CACHE[prompt_name]['results']
                 metrics_meta[prompt_name] = {"trials": [cached_meta]}
-                metrics_results[prompt_name] = [cached_results]
+                finish_trial(prompt_name, 0, cached_results)
+                if PARQUET_RESULTS:
+                    write_results({prompt_name: [cached_results]}, model='mistral-small-latest', provider='mistral', version=LANG)
                 pbar.update(1)
                 continue
 
-            metrics_results[prompt_name] = []
             metrics_meta[prompt_name] = {"trials": []}
+            # this prompt's trials, for the Parquet store (it rewrites the whole prompt partition)
+            prompt_trials = []
 
             for trial_idx in range(NUM_TRIALS):
                 pbar.set_description(f'Evaluating: {prompt_name} (trial {trial_idx+1}/{NUM_TRIALS})')
 
-                batch_data = []
-                for group_name, tests in metrics_tests.items():
-                    question_test = tests['Test']
-                    keywords = tests['Keywords']
-                    answer_reference = tests['Reference']
-                    answer_candidates = tests['Candidates']
-                    for candidate in answer_candidates:
-                        batch_data.append({
-                            'group_name': group_name,
-                            'question_test': question_test,
-                            'keywords': keywords,
-                            'answer_reference': answer_reference,
-                            'candidate': candidate
-                        })
-
                 def prompt_funct(expected_answer, given_answer, query):
                     out = prompt
                     out += f"""
@@ -130,51 +121,72 @@ GIVEN ANSWER:
 """.strip()
                     return out
 
-                raw_scores = []
-                for item in batch_data:
-                    result = llm_judge_custom(
-                        references=[item['answer_reference']], 
-                        predictions=[item['candidate']['Candidate']],
-                        query=item['question_test'],
-                        llm='mistral-small-latest',
-                        prompt_funct=prompt_funct
-                    )
-                    raw_scores.append(result['score'])
-
-                expected_binaries = [item['candidate']['Binary'] for item in batch_data]
+                # identical (reference, answer, query) items are judged once per trial; trials themselves
+                # are never merged, they measure the judge variance
+                items = dataset.items
+                unique, inverse = dedup.collapse(prompt_name, [(item.full_ref_id, item.candidate_id, item.test_id) for item in items])
+                unique_scores = []
+                for item in (items[p] for p in unique):
+                    try:
+                        result = llm_judge_custom(
+                            references=[dataset.reference(item)], 
+                            predictions=[dataset.candidate(item)],
+                            query=dataset.test(item),
+                            llm='mistral-small-latest',
+                            prompt_funct=prompt_funct,
+                            use_cache=USE_RESPONSE_CACHE,
+                            label=prompt_name
+                        )
+                    except Exception as exc:
+                        # retries are exhausted: keep the rest of the run, this item stays unscored (bugs still raise)
+                        if not is_provider_error(exc):
+                            raise
+                        print(f"Evaluation failed for {dataset.group(item)}: {type(exc).__name__}: {exc}")
+                        unique_scores.append(None)
+                        continue
+                    unique_scores.append(result['score'])
+                raw_scores = Deduplicator.expand(unique_scores, inverse)
+
+                expected_binaries = dataset.expected_binaries()
                 threshold, best_f1 = compute_best_threshold(raw_scores, expected_binaries)
                 metrics_meta[prompt_name]["trials"].append({"threshold": threshold, "best_f1": best_f1})
 
+                binary_preds = binarize(raw_scores, threshold)
+
                 trial_results = []
-                for item, raw_score in zip(batch_data, raw_scores):
-                    candidate = item['candidate']
-                    binary_pred = None
-                    if candidate['Binary'] is not None:
-                        comp_value = raw_score if raw_score is not None else float('nan')
-                        binary_pred = int(comp_value >= threshold) if raw_score is not None else None
+                for item, raw_score, bp in zip(dataset, raw_scores, binary_preds):
+                    binary_pred = bp if item.binary is not None else None
                     trial_results.append({
-                        "group": item['group_name'],
-                        "test": item['question_test'],
-                        "candidate": candidate['Candidate'],
-                        "expected_continuous": candidate['Expected'],
-                        "expected_binary": candidate['Binary'],
-                        "weight": candidate['Weight'],
+                        "group": dataset.group(item),
+                        "test": dataset.test(item),
+                        "candidate": dataset.candidate(item),
+                        "expected_continuous": item.continuous,
+                        "expected_binary": item.binary,
+                        "weight": item.weight,
                         "result_continuous": raw_score,
                         "result_binary": binary_pred,
                         "threshold": threshold
                     })
 
-                metrics_results[prompt_name].append(trial_results)
+                finish_trial(prompt_name, trial_idx, trial_results)
+                if PARQUET_RESULTS:
+                    prompt_trials.append(trial_results)
                 
                 # Cache only single-trial runs
                 if NUM_TRIALS == 1:
-                    add_to_cache(prompt_name, metrics_meta[prompt_name]["trials"][0], metrics_results[prompt_name][0])
+                    add_to_cache(prompt_name, metrics_meta[prompt_name]["trials"][0], trial_results)
 
                 pbar.update(1)
 
+            if PARQUET_RESULTS:
+                write_results({prompt_name: prompt_trials}, model='mistral-small-latest', provider='mistral', version=LANG)
+
     os.makedirs(ROOT_FOLDER, exist_ok=True)
-    with open(f'{ROOT_FOLDER}/results_{LANG}.json', 'w') as f:
-        json.dump({"metrics": metrics_results, "meta": metrics_meta}, f, indent=4)
+    if writer is not None:
+        writer.close()
+    else:
+        with open(f'{ROOT_FOLDER}/results_{LANG}.json', 'w') as f:
+            json.dump({"metrics": metrics_results, "meta": metrics_meta}, f, indent=4)
 
     result_str = '='*50 + '\n' + "FINAL RESULTS (mean ± std across trials)" + '\n' + '='*50 + '\n'
     print("="*50)
@@ -183,42 +195,16 @@ GIVEN ANSWER:
 
     for prompt in prompts:
         prompt_name = prompt['label']
-        trials = metrics_results.get(prompt_name, [])
+        trials = trial_summaries.get(prompt_name, [])
 
         cont_scores = []
         f1_scores = []
         acc_scores = []
 
-        for trial_results in trials:
-            total_continuous = 0.0
-            count_continuous = 0
-            total_binary = 0
-            correct_binary = 0
-            y_true = []
-            y_pred = []
-            for res in trial_results:
-                if res['expected_continuous'] is not None and res['result_continuous'] is not None:
-                    total_continuous += 1 - abs(res['expected_continuous'] - res['result_continuous'])
-                    count_continuous += 1
-                if res['expected_binary'] is not None and res['result_binary'] is not None:
-                    total_binary += 1
-                    correct_binary += 1 if res['expected_binary'] == res['result_binary'] else 0
-                    y_true.append(res['expected_binary'])
-                    y_pred.append(res['result_binary'])
-            if y_true:
-                tp = sum(1 for t, p in zip(y_true, y_pred) if t == 1 and p == 1)
-                fp = sum(1 for t, p in zip(y_true, y_pred) if t == 0 and p == 1)
-                fn = sum(1 for t, p in zip(y_true, y_pred) if t == 1 and p == 0)
-                precision = tp / (tp + fp) if (tp + fp) > 0 else 0.0
-                recall = tp / (tp + fn) if (tp + fn) > 0 else 0.0
-                f1 = 2 * precision * recall / (precision + recall) if (precision + recall) > 0 else 0.0
-            else:
-                f1 = 0.0
-            final_continuous = total_continuous / count_continuous if count_continuous > 0 else 0.0
-            binary_accuracy = correct_binary / total_binary if total_binary > 0 else 0.0
-            cont_scores.append(final_continuous)
-            f1_scores.append(f1)
-            acc_scores.append(binary_accuracy)
+        for summary in trials:
+            cont_scores.append(summary['continuous'])
+            f1_scores.append(summary['f1'])
+            acc_scores.append(summary['accuracy'])
 
         # Compute mean/std (std = 0.0 when trials = 1)
         def _mean(xs):
@@ -243,7 +229,17 @@ GIVEN ANSWER:
         )
         print(output)
         result_str += output + '\n'
+
+        if prompt_name in bootstrap_cis:
+            output = f"Prompt: {prompt_name:<25} | {format_ci(bootstrap_cis[prompt_name])}"
+            print(output)
+            result_str += output + '\n'
         
+    print(f"LLM calls: {JUDGE_SCHEDULER.stats.summary()}")
+    print(JUDGE_USAGE.report())
+    JUDGE_USAGE.save(f'{ROOT_FOLDER}/usage_{LANG}.json')
+    print(dedup.summary())
+
     with open(f'{ROOT_FOLDER}/final_results_{LANG}.txt', 'w') as f:
         f.write(result_str)
 
@@ -0,0 +1,84 @@
+"""
+Query the Parquet results store written with --parquet (see lib/results_store.py).
+
+    python query_results.py summary [--where metric=bleurt,version=v2] [--by main_category]
+    python query_results.py delta version v1 v2 [--where provider=mistral] [--by main_category]
+    python query_results.py import output/evaluations/metrics/v2/results.json -m none -p local -v v2
+
+Only the columns a query needs are read, and --where conditions are pushed down to the
+partitions (metric, model, provider, version) and to the Parquet row groups.
+"""
+
+from lib.results_store import PARTITIONS, RESULTS_STORE_DIR, open_results, where, write_results
+from lib.results_stream import read_results
+from lib.evaluation import summarize
+import pandas as pd
+import json
+import sys
+
+SCORE_COLUMNS = ['expected_continuous', 'expected_binary', 'result_continuous', 'result_binary']
+SUMMARY_COLUMNS = ['n', 'continuous', 'f1', 'accuracy']
+
+def parse_where(arg):
+    return dict(condition.split('=', 1) for condition in arg.split(',') if condition)
+
+def load(conditions, keys, root):
+    dataset = open_results(root)
+    table = dataset.to_table(columns=list(dict.fromkeys(keys + SCORE_COLUMNS)), filter=where(conditions, dataset))
+    return table.to_pandas()
+
+def summary_table(df, keys):
+    rows = []
+    for values, group in df.groupby(keys, dropna=False, sort=True):
+        summary = summarize(*(group[column].tolist() for column in SCORE_COLUMNS))
+        rows.append({**dict(zip(keys, values)), 'n': len(group), **{k: summary[k] for k in SUMMARY_COLUMNS[1:]}})
+    return pd.DataFrame(rows, columns=keys + SUMMARY_COLUMNS)
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    command = sys.argv[1]
+    root = sys.argv[sys.argv.index("--root") + 1] if "--root" in sys.argv else RESULTS_STORE_DIR
+    conditions = parse_where(sys.argv[sys.argv.index("--where") + 1]) if "--where" in sys.argv else {}
+    by = sys.argv[sys.argv.index("--by") + 1].split(',') if "--by" in sys.argv else []
+    pd.set_option('display.width', 200)
+
+    if command == 'summary':
+        keys = PARTITIONS + ['ref_mode'] + by
+        df = load(conditions, keys, root)
+        print(summary_table(df, keys).to_string(index=False, float_format='{:.4f}'.format))
+
+    elif command == 'delta':
+        # e.g. delta version v1 v2: per-metric (and --by) change going from v1 to v2
+        column, before, after = sys.argv[2:5]
+        keys = [c for c in PARTITIONS if c != column] + ['ref_mode'] + by
+        tables = []
+        for value in (before, after):
+            df = load({**conditions, column: value}, keys + [column], root)
+            tables.append(summary_table(df, keys))
+        merged = tables[0].merge(tables[1], on=keys, how='outer', suffixes=(f'_{before}', f'_{after}'))
+        for stat in SUMMARY_COLUMNS[1:]:
+            merged[f'delta_{stat}'] = merged[f'{stat}_{after}'] - merged[f'{stat}_{before}']
+        columns = keys + [f'{stat}_{value}' for stat in ('f1',) for value in (before, after)] + [f'delta_{stat}' for stat in SUMMARY_COLUMNS[1:]]
+        print(merged[columns].to_string(index=False, float_format='{:+.4f}'.format))
+
+    elif command == 'import':
+        # existing results*.json (or a --stream results*.jsonl) into the store
+        path = sys.argv[2]
+        model = sys.argv[sys.argv.index("-m") + 1] if "-m" in sys.argv else 'none'
+        provider = sys.argv[sys.argv.index("-p") + 1] if "-p" in sys.argv else 'local'
+        version = sys.argv[sys.argv.index("-v") + 1] if "-v" in sys.argv else 'v2'
+        if path.endswith('.jsonl'):
+            results = read_results(path)
+        else:
+            with open(path, 'r') as f:
+                results = json.load(f)
+        write_results(results['metrics'], model, provider, version, root)
+        print(f"Imported {len(results['metrics'])} metrics into {root}")
+
+    else:
+        raise ValueError(f"Unknown command: {command}")
+
+if __name__ == "__main__":
+    main()